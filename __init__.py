@@ -1,6 +1,9 @@
 import bpy
 from pragma_udm_io.ui import *
 from pragma_udm_io.ui.operators import PRAGMA_OT_PMAPImport
+from pragma_udm_io.asset_handlers.vtf import unload as unload_vtflib
+from pragma_udm_io.asset_handlers.pskel import clear_skeleton_cache
+from pragma_udm_io.asset_handlers.pmdl import clear_material_roots
 
 bl_info = {
     "name": "Pragma UDM IO",
@@ -18,7 +21,9 @@ classes = (
     PRAGMA_OT_PMLDImport,
     PRAGMA_OT_PMATImport,
     PRAGMA_OT_PMAPImport,
+    PRAGMA_OT_MaterializeFlexes,
     PRAGMA_MT_Menu,
+    PRAGMA_PT_Flexes,
 )
 
 register_, unregister_ = bpy.utils.register_classes_factory(classes)
@@ -35,12 +40,17 @@ def register():
     # register_custom_icon()
     register_()
     bpy.types.TOPBAR_MT_file_import.append(menu_import)
+    bpy.types.MESH_MT_shape_key_context_menu.append(menu_shape_key_specials)
 
 
 def unregister():
     bpy.types.TOPBAR_MT_file_import.remove(menu_import)
+    bpy.types.MESH_MT_shape_key_context_menu.remove(menu_shape_key_specials)
 
     # SingletonMeta.cleanup()
+    unload_vtflib()
+    clear_skeleton_cache()
+    clear_material_roots()
 
     # unregister_custom_icon()
     unregister_()
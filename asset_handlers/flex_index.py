@@ -0,0 +1,20 @@
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+FlexKey = Tuple[int, int, int]
+
+
+def build_flex_index(root) -> Dict[FlexKey, List[tuple]]:
+    """Maps (mesh group, mesh, sub mesh) ids to the (flex name, mesh animation) pairs that target them.
+    One pass over morphTargetAnimations instead of one per sub mesh.
+    """
+    flex_index = defaultdict(list)
+    if 'morphTargetAnimations' in root:
+        for flex in root['morphTargetAnimations'].values():
+            assert flex['assetType'] == "PMORPHANI"
+            flex_data = flex['assetData']
+            flex_name = flex_data['name']
+            for mesh_anim in flex_data['meshAnimations']:
+                key = (mesh_anim['meshGroup'], mesh_anim['mesh'], mesh_anim['subMesh'])
+                flex_index[key].append((flex_name, mesh_anim))
+    return flex_index
@@ -0,0 +1,85 @@
+from typing import Callable
+
+import numpy as np
+
+ErrorFunction = Callable[[np.ndarray, np.ndarray], np.ndarray]
+
+
+def linear_error(interpolated: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Largest per component distance from the straight line between the surrounding keys."""
+    return np.abs(interpolated - values).max(axis=-1)
+
+
+def quaternion_angle_error(interpolated: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Rotation angle between the normalized interpolated quaternion and the sampled one."""
+    norms = np.linalg.norm(interpolated, axis=-1)
+    dots = np.abs(np.einsum('ij,ij->i', interpolated, values))
+    cos_half = np.divide(dots, norms * np.linalg.norm(values, axis=-1), out=np.zeros_like(dots), where=norms > 0)
+    return 2 * np.arccos(np.clip(cos_half, 0.0, 1.0))
+
+
+def make_quaternions_continuous(quats: np.ndarray) -> np.ndarray:
+    """Flips quaternions so neighbouring samples are in the same hemisphere, q and -q are the same rotation."""
+    dots = np.einsum('ij,ij->i', quats[1:], quats[:-1])
+    flips = np.concatenate(([False], dots < 0))
+    signs = np.where(np.logical_xor.accumulate(flips), -1, 1).astype(quats.dtype)
+    return quats * signs[:, None]
+
+
+def _merge_errors(times: np.ndarray, values: np.ndarray, keys: np.ndarray, error_function: ErrorFunction):
+    """Error of every sample against each possible merge of two neighbouring key segments.
+    Entry j is the worst error if keys[j] was removed, only 1..len(keys)-2 are meaningful.
+    """
+    errors = np.zeros(len(keys), dtype=np.float64)
+    samples = np.arange(keys[0], keys[-1] + 1)
+    # Segment s spans keys[s]..keys[s + 1], samples on a key are put into the segment that starts there
+    segments = np.minimum(np.searchsorted(keys, samples, 'right') - 1, len(keys) - 2)
+
+    # Every sample belongs to two merges: the one removing the key its segment starts at and the one removing
+    # the key it ends at. Removing keys[j] makes keys[j - 1]..keys[j + 1] a single linear segment.
+    for candidate_offset in (0, 1):
+        candidates = segments + candidate_offset
+        valid = (candidates >= 1) & (candidates <= len(keys) - 2)
+        candidates = candidates[valid]
+        sample_ids = samples[valid]
+        left = keys[candidates - 1]
+        right = keys[candidates + 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Keys sharing a time give nan errors, which are never within tolerance
+            factor = ((times[sample_ids] - times[left]) / (times[right] - times[left]))[:, None]
+        interpolated = values[left] + (values[right] - values[left]) * factor
+        np.maximum.at(errors, candidates, error_function(interpolated, values[sample_ids]))
+    return errors
+
+
+def reduce_keys(times: np.ndarray, values: np.ndarray, tolerance: float,
+                error_function: ErrorFunction = linear_error) -> np.ndarray:
+    """Returns indices of the samples to keep so that linear interpolation between them
+    stays within tolerance of every original sample. values is (N, C), times must be increasing.
+    """
+    keys = np.arange(len(times))
+    if len(keys) <= 2 or tolerance <= 0:
+        return keys
+    values = values.reshape((len(times), -1)).astype(np.float64)
+    times = times.astype(np.float64)
+    while len(keys) > 2:
+        errors = _merge_errors(times, values, keys, error_function)
+        removable = errors <= tolerance
+        removable[0] = removable[-1] = False
+        if not removable.any():
+            break
+        # Neighbouring keys can't be dropped in the same pass, the merged error would be unknown.
+        # Take every other key from each run of removable ones.
+        positions = np.arange(len(keys))
+        run_starts = np.maximum.accumulate(np.where(removable & ~np.roll(removable, 1), positions, 0))
+        keys = keys[~(removable & ((positions - run_starts) % 2 == 0))]
+    return keys
+
+
+def reduce_location_keys(times: np.ndarray, values: np.ndarray, tolerance: float) -> np.ndarray:
+    return reduce_keys(times, values, tolerance, linear_error)
+
+
+def reduce_rotation_keys(times: np.ndarray, quats: np.ndarray, tolerance: float) -> np.ndarray:
+    """quats have to be sign continuous already, see make_quaternions_continuous. tolerance is in radians."""
+    return reduce_keys(times, quats, tolerance, quaternion_angle_error)
@@ -1,3 +1,4 @@
+import hashlib
 import math
 from dataclasses import dataclass, field
 from pathlib import Path
@@ -7,6 +8,7 @@ import bpy
 import numpy as np
 from mathutils import Vector, Quaternion, Matrix
 
+from .keyframe_reduction import make_quaternions_continuous, reduce_location_keys, reduce_rotation_keys
 from .pmap import import_pmap
 from .pmdl import import_pmdl
 from ..content_managment import ContentManager
@@ -31,16 +33,59 @@ class Actor:
 def convert_loc(x): return Vector([x[0], -x[2], x[1]])
 def convert_quat(q): return Quaternion([q[3], q[0], -q[2], q[1]])
 
+# TODO: Get these from pskel
+ROTATION_BEFORE = np.array((0.7071068286895752, 0.0, 0.0, -0.7071068286895752), dtype=np.float32)
+ROTATION_AFTER = np.array((0.7071068286895752, 0.0, 0.0, 0.7071068286895752), dtype=np.float32)
+# Value of the 'LINEAR' item of Keyframe.interpolation, enums are written as ints by foreach_set
+KEYFRAME_LINEAR = 1
+
+
+def quaternion_multiply(a: np.ndarray, b: np.ndarray):
+    """Hamilton product of wxyz quaternion arrays, broadcasts like a @ b would for mathutils.Quaternion."""
+    aw, ax, ay, az = np.moveaxis(a, -1, 0)
+    bw, bx, by, bz = np.moveaxis(b, -1, 0)
+    return np.stack([aw * bw - ax * bx - ay * by - az * bz,
+                     aw * bx + ax * bw + ay * bz - az * by,
+                     aw * by - ax * bz + ay * bw + az * bx,
+                     aw * bz + ax * by - ay * bx + az * bw], axis=-1)
+
+
+def convert_bone_rotations(values: np.ndarray):
+    """(N, 4) xyzw Pragma rotations to Blender wxyz pose bone rotations."""
+    x, y, z, w = values.T
+    rotations = np.stack([w, x, -z, y], axis=-1)
+    return quaternion_multiply(quaternion_multiply(ROTATION_AFTER, rotations), ROTATION_BEFORE)
+
+
+def write_keyframes(curve: bpy.types.FCurve, frames: np.ndarray, values: np.ndarray):
+    keyframe_count = len(frames)
+    co = np.empty((keyframe_count, 2), dtype=np.float32)
+    co[:, 0] = frames
+    co[:, 1] = values
+    curve.keyframe_points.add(keyframe_count)
+    curve.keyframe_points.foreach_set('co', co.reshape(-1))
+    curve.keyframe_points.foreach_set('interpolation', np.full(keyframe_count, KEYFRAME_LINEAR, dtype=np.int32))
+    curve.update()
+
+
 class PFMPLoader:
 
-    def __init__(self, path: Path, scale=1.0):
+    def __init__(self, path: Path, scale=1.0, location_tolerance=0.0, rotation_tolerance=0.0, sparse_flexes=False):
         self.path = path
         self._udm_file = UDM()
         self.scale = scale
+        # Actor models keep their flexes as sparse deltas instead of shape keys, see store_sparse_flexes
+        self.sparse_flexes = sparse_flexes
+        # Keys that linear interpolation reproduces within these tolerances are dropped, 0 keeps every key.
+        # Location tolerance is in scaled scene units, rotation tolerance is in radians.
+        self.location_tolerance = location_tolerance
+        self.rotation_tolerance = rotation_tolerance
         assert self._udm_file.load(path), f'Failed to load "{path}"'
 
         self.project = PragmaFilmMakerProject(self._udm_file)
         self._actors: Dict[str, Actor] = {}
+        # hash of the animation channel data -> action, actors playing the same clip share it
+        self._actions: Dict[str, bpy.types.Action] = {}
         self.master_collection = get_new_unique_collection(self.session_name + '_session', bpy.context.scene.collection)
         self.props_collection = get_new_unique_collection(self.session_name + '_props', self.master_collection)
         self._component_handlers = {
@@ -98,50 +143,95 @@ class PFMPLoader:
                 import_pmap(map_file)
 
     def load_actors(self):
-        active_clip = self.active_clip
-        for track_group in active_clip.track_groups:
+        for film_clip in self._iter_film_clips():
+            scene = film_clip['scene']
+            for actor in scene['actors']:
+                self._process_actor(actor)
+            for group in scene['groups']:
+                for actor in group['actors']:
+                    self._process_actor(actor)
+            for animation_clip in self._iter_animation_clips(film_clip):
+                actor = self._actors[animation_clip['actor']]
+                animation_data = animation_clip['animation']['assetData']
+                animation_action = self._get_action(f'{film_clip["name"]}_{actor.name}_ACTION', animation_data)
+
+                if not actor.object.animation_data:
+                    actor.object.animation_data_create()
+                self._add_action_strip(actor.object, animation_action, animation_clip)
+
+    def _iter_film_clips(self):
+        for track_group in self.active_clip.track_groups:
             for track in track_group.tracks:
-                for film_clip in track.film_clips:
-                    scene = film_clip['scene']
-                    for actor in scene['actors']:
-                        self._process_actor(actor)
-                    for group in scene['groups']:
-                        for actor in group['actors']:
-                            self._process_actor(actor)
-                    for track_group2 in film_clip['trackGroups']:
-                        for track2 in track_group2['tracks']:
-                            for animation_clip in track2['animationClips']:
-                                actor = self._actors[animation_clip['actor']]
-                                animation = animation_clip['animation']
-                                animation_data = animation['assetData']
-
-                                animation_action = bpy.data.actions.new(f'{film_clip["name"]}_{actor.name}_ACTION')
-
-                                if not actor.object.animation_data:
-                                    actor.object.animation_data_create()
-
-                                actor.object.animation_data.action = animation_action
-                                actor.object.animation_data.action = animation_action
-                                actor.object.animation_data.action = animation_action
-                                actor.object.animation_data.action = animation_action
-
-                                for channel in animation_data['channels']:
-                                    values = channel['values'].value()
-                                    times = channel['times'].value()
-                                    values = values[times > 0]
-                                    times = times[times > 0]
-                                    if len(values) == 0 or len(times) == 0:
-                                        continue
-                                    path = channel['targetPath'].split('/')
-                                    assert path[0] == 'ec'
-                                    if path[1] == 'flex':
-                                        pass  # TODO: flex animation
-                                    elif path[1] == 'animated' and path[2] == 'bone':
-                                        self._load_bone_animation(animation_action, path[3], path[4], values, times)
-                                    elif path[1] == 'pfm_actor':
-                                        pass  # TODO: actor transforms
-                                    else:
-                                        raise NotImplementedError(channel['targetPath'])
+                yield from track.film_clips
+
+    @staticmethod
+    def _iter_animation_clips(film_clip: ElementProperty):
+        for track_group in film_clip['trackGroups']:
+            for track in track_group['tracks']:
+                yield from track['animationClips']
+
+    @staticmethod
+    def _iter_channels(animation_data: ElementProperty):
+        # Only one channel is held in memory at a time, consumers must not keep the arrays around
+        for channel in animation_data['channels']:
+            values = channel['values'].value()
+            times = channel['times'].value()
+            yield channel['targetPath'], values, times
+            del values, times
+
+    def _hash_channels(self, animation_data: ElementProperty):
+        digest = hashlib.sha1()
+        for target_path, values, times in self._iter_channels(animation_data):
+            digest.update(f'{target_path}:{values.dtype}{values.shape}:{times.dtype}{times.shape}'.encode('utf8'))
+            digest.update(values.tobytes())
+            digest.update(times.tobytes())
+            del values, times
+        return digest.hexdigest()
+
+    def _get_action(self, name: str, animation_data: ElementProperty):
+        # Hashing and building are separate passes over the channels, so only one channel is loaded at a time
+        key = self._hash_channels(animation_data)
+        action = self._actions.get(key, None)
+        if action is not None:
+            return action
+
+        action = bpy.data.actions.new(name)
+        kept_keys = total_keys = 0
+        for target_path, values, times in self._iter_channels(animation_data):
+            mask = times > 0
+            values = values[mask]
+            times = times[mask]
+            del mask
+            if len(values) == 0 or len(times) == 0:
+                continue
+            path = target_path.split('/')
+            assert path[0] == 'ec'
+            if path[1] == 'flex':
+                pass  # TODO: flex animation
+            elif path[1] == 'animated' and path[2] == 'bone':
+                kept_keys += self._load_bone_animation(action, path[3], path[4], values, times)
+                total_keys += len(times)
+            elif path[1] == 'pfm_actor':
+                pass  # TODO: actor transforms
+            else:
+                raise NotImplementedError(target_path)
+            del values, times
+        if total_keys and (self.location_tolerance > 0 or self.rotation_tolerance > 0):
+            print(f'Action "{action.name}": kept {kept_keys}/{total_keys} keys '
+                  f'({kept_keys / total_keys:.1%})')
+        self._actions[key] = action
+        return action
+
+    def _add_action_strip(self, obj: bpy.types.Object, action: bpy.types.Action, animation_clip: ElementProperty):
+        start_offset = 0.0
+        time_frame = animation_clip.get('timeFrame', None)
+        if time_frame is not None:
+            start_offset = time_frame.get('startOffset', 0.0)
+        track = obj.animation_data.nla_tracks.new()
+        track.name = action.name
+        strip = track.strips.new(action.name, int(start_offset * bpy.context.scene.render.fps), action)
+        # Keep action frame 0 on the strip start, so the clip offset is the only per actor difference
+        strip.action_frame_start = 0
 
     def _convert_rotation(self, rot):
         return convert_quat(rot)
@@ -150,55 +240,27 @@ class PFMPLoader:
                              values: np.ndarray, times: np.ndarray):
         group = action.groups.get(bone_name, False) or action.groups.new(bone_name)
         if channel == 'rotation':
-            x = values[:, 0].copy()
-            y = values[:, 1].copy()
-            z = values[:, 2].copy()
-            w = values[:, 3].copy()
-            values[:, 0], values[:, 1], values[:, 2], values[:, 3] = w, x, y, z
-            curve_count = 4
+            values = convert_bone_rotations(values)
             curve_channel = 'rotation_quaternion'
+            if self.rotation_tolerance > 0:
+                values = make_quaternions_continuous(values)
+                keys = reduce_rotation_keys(times, values, self.rotation_tolerance)
+                values, times = values[keys], times[keys]
         elif channel == 'position':
-            values *= self.scale
-            curve_count = 3
+            values = values * self.scale
             curve_channel = 'location'
+            if self.location_tolerance > 0:
+                keys = reduce_location_keys(times, values, self.location_tolerance)
+                values, times = values[keys], times[keys]
         else:
             raise NotImplementedError(channel)
-        curves = []
-        for i in range(curve_count):
+
+        frames = (times * bpy.context.scene.render.fps).astype(np.int32)
+        for i in range(values.shape[1]):
             curve = action.fcurves.new(data_path=f'pose.bones["{bone_name}"].{curve_channel}', index=i)
-            curve.keyframe_points.add(len(times))
             curve.group = group
-            curves.append(curve)
-
-        scene_fps = bpy.context.scene.render.fps
-        if channel == 'rotation':
-            for keyframe_id, (time, value) in enumerate(zip(times, values)):
-                frame_id = int(time * scene_fps)
-                #print('Frame ', frame_id)
-                #print('WXYZ', value.round(1))
-                value = [value[1],value[2],value[3],value[0]]
-                value = convert_quat(value)
-
-                # TODO: Get these from pskel
-                rotBefore = Quaternion((0.7071068286895752, 0.0, 0.0, -0.7071068286895752))
-                rotAfter = Quaternion((0.7071068286895752, 0.0, 0.0, 0.7071068286895752))
-                value = rotAfter @ value @ rotBefore
-
-                #print('WXYZ converted', value)
-                #print('========')
-                for i in range(curve_count):
-                    frame = curves[i].keyframe_points[keyframe_id]
-                    frame.co = (frame_id, value[i])
-                    frame.interpolation = 'LINEAR'
-        else:
-            for keyframe_id, (time, value) in enumerate(zip(times, values)):
-                frame_id = int(time * scene_fps)
-                #value = convert_loc(value)
-
-                for i in range(curve_count):
-                    frame = curves[i].keyframe_points[keyframe_id]
-                    frame.co = (frame_id, value[i])
-                    frame.interpolation = 'LINEAR'
+            write_keyframes(curve, frames, values[:, i])
+        return len(times)
 
     def _process_actor(self, actor):
         actor_name = actor['name']
@@ -291,7 +353,7 @@ class PFMPLoader:
         if model is None:
             print('Failed to load Actor model data')
             return
-        loader = import_pmdl(model, self.scale, self.props_collection, True)
+        loader = import_pmdl(model, self.scale, self.props_collection, True, sparse_flexes=self.sparse_flexes)
         if loader.armature:
             actor_object.child_objects.append(loader.armature)
         else:
@@ -1,11 +1,13 @@
 import json
 from pathlib import Path
+from typing import Dict, Tuple
 
 import bpy
 from mathutils import Vector, Quaternion, Matrix
 
 from pragma_udm_io.utils import *
 from .pmdl import import_pmdl
+from .texture_registry import ImageRegistry
 from ..pragma_udm_wrapper import UDM
 from ..content_managment.content_manager import ContentManager
 from ..pragma_udm_wrapper.properties import ElementProperty
@@ -14,19 +16,48 @@ CM = ContentManager()
 
 
 class PMAPLoader:
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, use_instances=True, sparse_flexes=False):
         self.path = path
+        self.use_instances = use_instances
+        self.sparse_flexes = sparse_flexes
         self._udm_file = UDM()
         assert self._udm_file.load(path), f'Failed to load "{path}"'
         self.root = self._udm_file.root
 
         self._objects = []
+        self._model_templates: Dict[Tuple[Path, bool], bpy.types.Collection] = {}
+        self._templates_collection = None
         self.master_collection = get_new_unique_collection(self.model_name + '_map', bpy.context.scene.collection)
 
     @property
     def model_name(self):
         return self.path.stem
 
+    @property
+    def templates_collection(self):
+        if self._templates_collection is None:
+            self._templates_collection = get_new_unique_collection(self.model_name + '_templates',
+                                                                   self.master_collection)
+            exclude_collection(self._templates_collection)
+        return self._templates_collection
+
+    def _get_model_template(self, model_path: Path, scale, no_collections):
+        key = (model_path, no_collections)
+        template = self._model_templates.get(key, None)
+        if template is None:
+            loader = import_pmdl(model_path, scale, self.templates_collection, no_collections, load_images=False,
+                                 sparse_flexes=self.sparse_flexes)
+            template = loader.master_collection
+            self._model_templates[key] = template
+        return template
+
+    def _instance_model(self, model_path: Path, scale, no_collections, object_name, collection):
+        instance = bpy.data.objects.new(object_name, None)
+        instance.instance_type = 'COLLECTION'
+        instance.instance_collection = self._get_model_template(model_path, scale, no_collections)
+        collection.objects.link(instance)
+        return instance
+
     def load_mesh(self, scale):
         for ent in self.root['entities']:
             class_name = ent['className']
@@ -51,7 +82,15 @@ class PMAPLoader:
                     continue
 
                 type_collection = get_or_create_collection(class_name, self.master_collection)
-                loader = import_pmdl(model_path, scale, type_collection, not class_name.startswith('prop_'))
+                no_collections = not class_name.startswith('prop_')
+                if self.use_instances:
+                    instance = self._instance_model(model_path, scale, no_collections, object_name, type_collection)
+                    instance['entity_data'] = {'entity': json.loads(key_values.to_json())}
+                    instance.matrix_basis = mat
+                    continue
+
+                loader = import_pmdl(model_path, scale, type_collection, no_collections, load_images=False,
+                                     sparse_flexes=self.sparse_flexes)
                 if loader.is_static_prop:
                     for obj in loader.objects:
                         obj.name = object_name
@@ -65,7 +104,7 @@ class PMAPLoader:
         pass
 
     def load_textures(self):
-        pass
+        ImageRegistry().load_pending()
 
     def finalize(self):
         pass
@@ -74,8 +113,8 @@ class PMAPLoader:
         pass
 
 
-def import_pmap(path: Path, scale=1.0):
-    loader = PMAPLoader(path)
+def import_pmap(path: Path, scale=1.0, use_instances=True, sparse_flexes=False):
+    loader = PMAPLoader(path, use_instances, sparse_flexes)
     loader.load_mesh(scale)
     loader.load_textures()
     loader.finalize()
@@ -3,14 +3,16 @@ from pathlib import Path
 import bpy
 
 from ..content_managment.content_manager import ContentManager
+from ..pragma_udm_wrapper import UDM
 from ..pragma_udm_wrapper.properties import ElementProperty
 from ..utils.node import *
-from .vtf import load_texture
-from ..utils.texture_utils import texture_from_data
+from .shader_templates import get_template, PBR_TEMPLATE, PBR_BLEND_TEMPLATE, UNLIT_TEMPLATE, WATER_TEMPLATE
+from .texture_registry import ImageRegistry
 
 
 def _load_textures(textures):
     cm = ContentManager()
+    registry = ImageRegistry()
     maps = {}
     for map_name, texture in textures.items():
         path: Path = (cm.find_path(texture, 'materials', extension='.dds') or
@@ -20,17 +22,7 @@ def _load_textures(textures):
                       )
         if path is None:
             continue
-        if path.suffix == '.vtf':
-            image = bpy.data.images.get(texture, None)
-            if image is None:
-                image_data, *image_dimm = load_texture(path.open('rb'))
-                image = texture_from_data(texture, image_data, image_dimm, False)
-        else:
-            image = bpy.data.images.get(texture, None)
-            if image is None:
-                image = bpy.data.images.load(str(path))
-                image.name = texture
-        maps[map_name] = image
+        maps[map_name] = registry.get_image(path, texture)
     return maps
 
 
@@ -49,80 +41,59 @@ def _add_alpha(material, properties, albedo, shader):
         connect_nodes(material, albedo.outputs['Alpha'], shader.inputs['Alpha'])
 
 
-def _add_color_factor(material, properties, input_socket, output_socket):
+def _set_color_factor(properties, shader):
     if 'color_factor' in properties:
-        color = properties['color_factor']
-        color_mix = create_node(material, Nodes.ShaderNodeMixRGB, location=(-50, 250))
-        color_mix.blend_type = 'MULTIPLY'
-        color_mix.inputs['Fac'].default_value = 1.0
-        connect_nodes(material, input_socket, color_mix.inputs['Color1'])
-        color_mix.inputs['Color2'].default_value = (*color, 1.0)[:4]
-        connect_nodes(material, color_mix.outputs['Color'], output_socket)
-        return color_mix.outputs['Color']
-    else:
-        connect_nodes(material, input_socket, output_socket)
-        return input_socket
+        shader.inputs['Color Factor'].default_value = (*properties['color_factor'], 1.0)[:4]
 
 
 def _add_normal_map(material, maps, shader):
     if 'normal_map' in maps:
         normal = create_texture_node(material, maps['normal_map'], 'Normal', location=(-400, 000))
         normal.image.colorspace_settings.name = 'Non-Color'
-        normalmap_node = create_node(material, Nodes.ShaderNodeNormalMap, location=(-50, 000))
-        connect_nodes(material, normal.outputs['Color'], normalmap_node.inputs['Color'])
-        connect_nodes(material, normalmap_node.outputs['Normal'], shader.inputs['Normal'])
+        connect_nodes(material, normal.outputs['Color'], shader.inputs['Normal'])
 
 
 def _add_rma_map(material, properties, maps, shader):
+    # Without an RMA map the factors stay at 1, so the template defaults match a plain Principled BSDF
     if 'rma_map' in maps:
         rma = create_texture_node(material, maps['rma_map'], 'RMA', location=(-400, -250))
         rma.image.colorspace_settings.name = 'Non-Color'
-        rma_split = create_node(material, Nodes.ShaderNodeSeparateRGB, location=(-50, -250))
-        connect_nodes(material, rma.outputs['Color'], rma_split.inputs['Image'])
-        if 'roughness_factor' in properties or 'specular_factor' in properties:
-            if 'roughness_factor' in properties:
-                roughness_factor = properties['roughness_factor']
-            else:
-                roughness_factor = 1 - properties['specular_factor']
-            r_multiply = create_node(material, Nodes.ShaderNodeMath, name='Roughness-Multiplier', location=(-50, -400))
-            r_multiply.operation = 'MULTIPLY'
-            connect_nodes(material, rma_split.outputs['G'], r_multiply.inputs[0])
-            r_multiply.inputs[1].default_value = roughness_factor
-            connect_nodes(material, r_multiply.outputs[0], shader.inputs['Roughness'])
-        else:
-            connect_nodes(material, rma_split.outputs['G'], shader.inputs['Roughness'])
-
+        connect_nodes(material, rma.outputs['Color'], shader.inputs['RMA'])
+        if 'roughness_factor' in properties:
+            shader.inputs['Roughness Factor'].default_value = properties['roughness_factor']
+        elif 'specular_factor' in properties:
+            shader.inputs['Roughness Factor'].default_value = 1 - properties['specular_factor']
         if 'metalness_factor' in properties:
-            m_multiply = create_node(material, Nodes.ShaderNodeMath, name='Metallic-Multiplier', location=(-50, -550))
-            m_multiply.operation = 'MULTIPLY'
-            connect_nodes(material, rma_split.outputs['B'], m_multiply.inputs[0])
-            m_multiply.inputs[1].default_value = properties['metalness_factor']
-            connect_nodes(material, m_multiply.outputs[0], shader.inputs['Metallic'])
-        else:
-            connect_nodes(material, rma_split.outputs['B'], shader.inputs['Metallic'])
+            shader.inputs['Metalness Factor'].default_value = properties['metalness_factor']
 
 
-def _handle_pbr(material_asset: ElementProperty, material_name: str):
-    maps = _load_textures(material_asset['textures'])
-    properties = material_asset['properties']
-
+def _prepare_material(material_name, template_name):
     material = bpy.data.materials.get(material_name, None) or bpy.data.materials.new(material_name)
 
     if material.get('udm_loaded'):
-        return 'LOADED'
+        return material, None
 
     material['udm_loaded'] = True
     material.use_nodes = True
     clean_nodes(material)
 
     output = create_node(material, Nodes.ShaderNodeOutputMaterial, location=(800, 200))
-    shader = create_node(material, Nodes.ShaderNodeBsdfPrincipled, location=(400, 200))
+    shader = create_node_group(material, get_template(template_name).name, location=(400, 200))
     connect_nodes(material, shader.outputs['BSDF'], output.inputs['Surface'])
+    return material, shader
+
+
+def _handle_pbr(material_asset: ElementProperty, material_name: str):
+    material, shader = _prepare_material(material_name, PBR_TEMPLATE)
+    if shader is None:
+        return 'LOADED'
+    maps = _load_textures(material_asset['textures'])
+    properties = material_asset['properties']
 
     if 'albedo_map' in maps:
         albedo = create_texture_node(material, maps['albedo_map'], 'Albedo', location=(-400, 250))
-
-        _add_color_factor(material, properties, albedo.outputs['Color'], shader.inputs['Base Color'])
+        connect_nodes(material, albedo.outputs['Color'], shader.inputs['Albedo'])
+        _set_color_factor(properties, shader)
 
         _add_alpha(material, properties, albedo, shader)
 
@@ -137,36 +108,18 @@ def _handle_pbr(material_asset: ElementProperty, material_name: str):
 
 
 def _handle_pbr_blend(material_asset: ElementProperty, material_name: str):
+    material, shader = _prepare_material(material_name, PBR_BLEND_TEMPLATE)
+    if shader is None:
+        return 'LOADED'
     maps = _load_textures(material_asset['textures'])
     properties = material_asset['properties']
 
-    material = bpy.data.materials.get(material_name, None) or bpy.data.materials.new(material_name)
-
-    if material.get('udm_loaded'):
-        return 'LOADED'
-
-    material['udm_loaded'] = True
-    material.use_nodes = True
-    clean_nodes(material)
-
-    output = create_node(material, Nodes.ShaderNodeOutputMaterial, location=(800, 200))
-    shader = create_node(material, Nodes.ShaderNodeBsdfPrincipled, location=(400, 200))
-    connect_nodes(material, shader.outputs['BSDF'], output.inputs['Surface'])
-
     if 'albedo_map' in maps and 'albedo_map2' in maps:
-        albedo = create_texture_node(material, maps['albedo_map'], 'Albedo', location=(-650, 250))
-        albedo2 = create_texture_node(material, maps['albedo_map2'], 'Albedo2', location=(-650, 0))
-
-        mix_node = create_node(material, Nodes.ShaderNodeMixRGB, location=(-50, 200))
-
-        vertex_color_node = create_node(material, Nodes.ShaderNodeVertexColor, location=(-650, 350))
-        vertex_color_node.layer_name = 'alpha'
-        connect_nodes(material, vertex_color_node.outputs['Alpha'], mix_node.inputs['Fac'])
-
-        connect_nodes(material, albedo.outputs['Color'], mix_node.inputs['Color1'])
-        connect_nodes(material, albedo2.outputs['Color'], mix_node.inputs['Color2'])
-
-        _add_color_factor(material, properties, mix_node.outputs['Color'], shader.inputs['Base Color'])
+        albedo = create_texture_node(material, maps['albedo_map'], 'Albedo', location=(-400, 250))
+        albedo2 = create_texture_node(material, maps['albedo_map2'], 'Albedo2', location=(-400, 0))
+        connect_nodes(material, albedo.outputs['Color'], shader.inputs['Albedo'])
+        connect_nodes(material, albedo2.outputs['Color'], shader.inputs['Albedo 2'])
+        _set_color_factor(properties, shader)
 
         _add_alpha(material, properties, albedo, shader)
 
@@ -181,53 +134,30 @@ def _handle_pbr_blend(material_asset: ElementProperty, material_name: str):
 
 
 def _handle_unlit(material_asset: ElementProperty, material_name: str):
+    material, shader = _prepare_material(material_name, UNLIT_TEMPLATE)
+    if shader is None:
+        return 'LOADED'
     maps = _load_textures(material_asset['textures'])
     properties = material_asset['properties']
 
-    material = bpy.data.materials.get(material_name, None) or bpy.data.materials.new(material_name)
-
-    if material.get('udm_loaded'):
-        return 'LOADED'
-
-    material['udm_loaded'] = True
-    material.use_nodes = True
-    clean_nodes(material)
-
-    output = create_node(material, Nodes.ShaderNodeOutputMaterial, location=(800, 200))
-    shader = create_node(material, Nodes.ShaderNodeBsdfPrincipled, location=(400, 200))
-    shader.inputs['Specular'].default_value = 0.0
-    connect_nodes(material, shader.outputs['BSDF'], output.inputs['Surface'])
-
     if 'albedo_map' in maps:
         albedo = create_texture_node(material, maps['albedo_map'], 'Albedo', location=(-400, 250))
-
-        color_out = _add_color_factor(material, properties, albedo.outputs['Color'], shader.inputs['Base Color'])
-        connect_nodes(material, color_out, shader.inputs['Emission'])
+        connect_nodes(material, albedo.outputs['Color'], shader.inputs['Albedo'])
+        shader.inputs['Emission Strength'].default_value = 1.0
+        _set_color_factor(properties, shader)
         _add_alpha(material, properties, albedo, shader)
 
 
 def _handle_water(material_asset: ElementProperty, material_name: str):
-    maps = _load_textures(material_asset['textures'])
-    properties = material_asset['properties']
-
-    material = bpy.data.materials.get(material_name, None) or bpy.data.materials.new(material_name)
+    material, shader = _prepare_material(material_name, WATER_TEMPLATE)
     material.use_screen_refraction = True
     material.use_backface_culling = True
-
-    if material.get('udm_loaded'):
+    if shader is None:
         return 'LOADED'
+    maps = _load_textures(material_asset['textures'])
+    properties = material_asset['properties']
 
-    material['udm_loaded'] = True
-    material.use_nodes = True
-    clean_nodes(material)
-
-    output = create_node(material, Nodes.ShaderNodeOutputMaterial, location=(800, 200))
-    shader = create_node(material, Nodes.ShaderNodeBsdfPrincipled, location=(400, 200))
-    shader.inputs['Specular'].default_value = 0.5
-    shader.inputs['Roughness'].default_value = 0.035
-    shader.inputs['Transmission'].default_value = 1
-    shader.inputs['Base Color'].default_value = properties['fog']['color']
-    connect_nodes(material, shader.outputs['BSDF'], output.inputs['Surface'])
+    shader.inputs['Color'].default_value = properties['fog']['color']
     create_texture_node(material, maps['dudv_map'], 'DUDV', (-500, 0))
     _add_normal_map(material, maps, shader)
 
@@ -245,3 +175,37 @@ def import_pmat(asset: ElementProperty, material_name: str):
         print(asset.to_json())
         print(f'Unsupported shader {next(asset.items())[0]}')
         return 'UNSUPPORTED'
+
+
+def _material_source(path: Path):
+    path = path.absolute()
+    # ID properties only hold 32 bit ints, so the nanosecond mtime is kept in the string
+    return f'{path.as_posix()}|{path.stat().st_mtime_ns}'
+
+
+def import_pmat_file(path: Path, material_name: str):
+    """Imports a .pmat file unless the material was already built from the same unchanged file.
+    Returns 'REUSED' in that case, otherwise the result of import_pmat.
+    """
+    source = _material_source(path)
+    material = bpy.data.materials.get(material_name, None)
+    if material is not None and material.get('udm_loaded'):
+        material_source = material.get('pragma_source', None)
+        if material_source == source:
+            return 'REUSED'
+        if material_source is not None and material_source.rpartition('|')[0] == source.rpartition('|')[0]:
+            # Same file changed on disk since the last import, rebuild the node tree
+            del material['udm_loaded']
+
+    udm = UDM()
+    if not udm.load(path):
+        print(f'Failed to load "{path}"')
+        return 'FAILED'
+    try:
+        result = import_pmat(udm.root, material_name)
+    finally:
+        udm.destroy()
+    material = bpy.data.materials.get(material_name, None)
+    if material is not None and result is None:
+        material['pragma_source'] = source
+    return result
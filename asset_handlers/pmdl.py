@@ -1,22 +1,158 @@
 from collections import defaultdict
+from dataclasses import dataclass
+from fnmatch import fnmatch
 from pathlib import Path
+from typing import Optional, Dict, Tuple, List
+
 import numpy as np
 
 import bpy
 
-from ..asset_handlers.pmat import import_pmat
-from ..asset_handlers.pmesh import import_pmesh
+from ..asset_handlers.flex_index import build_flex_index
+from ..asset_handlers.pmat import import_pmat_file
+from ..asset_handlers.pmesh import read_pmesh, build_pmesh_object
 from ..asset_handlers.pskel import import_pskel
+from ..asset_handlers.texture_registry import ImageRegistry
 from ..content_managment.content_manager import ContentManager
 from ..pragma_udm_wrapper import UDM
-from ..utils import get_or_create_collection, get_new_unique_collection, ROTN90_X, transform_vec3_array
+from ..pragma_udm_wrapper.properties import ElementProperty
+from ..utils import get_or_create_collection, get_new_unique_collection, pragma_to_blender_vec3_array
+
+
+# model path -> {material name: material root it was found in}
+_material_roots: Dict[str, Dict[str, str]] = {}
+
+
+def clear_material_roots():
+    _material_roots.clear()
+
+
+@dataclass(slots=True)
+class FlexFrames:
+    names: List[str]
+    # Frame i owns indices[offsets[i]:offsets[i + 1]] and the matching rows of deltas
+    offsets: np.ndarray
+    indices: np.ndarray
+    deltas: np.ndarray
+
+
+def decode_flex_frames(flexes: List[Tuple[str, ElementProperty]], scale, vertex_offset=0) -> FlexFrames:
+    frames = []
+    total_count = 0
+    for flex_name, flex_data in flexes:
+        flex_name = flex_name.replace('flex_', '')
+        multi_frame_mode = len(flex_data['frames']) > 0
+        for frame_num, frame in enumerate(flex_data['frames']):
+            flex_indices = np.asarray(frame['vertexIndices'])
+            attribs = {attr['property']: attr['values'] for attr in frame['attributes']}
+            assert 'position' in attribs, f'Missing position attribute on ' \
+                                          f'"{flex_name}[{frame_num}]"'
+            full_flex_name = f"{flex_name}[{frame_num}]" if not multi_frame_mode else flex_name
+            frames.append((full_flex_name, flex_indices, attribs['position']))
+            total_count += len(flex_indices)
+
+    offsets = np.zeros(len(frames) + 1, dtype=np.int64)
+    indices = np.empty(total_count, dtype=np.int32)
+    deltas = np.empty((total_count, 3), dtype=np.float32)
+    for frame_id, (_, flex_indices, position) in enumerate(frames):
+        start = offsets[frame_id]
+        end = offsets[frame_id + 1] = start + len(flex_indices)
+        indices[start:end] = flex_indices
+        indices[start:end] += vertex_offset
+        delta = position.value().view(np.float16).reshape((-1, 4))[:, :3]
+        pragma_to_blender_vec3_array(delta, deltas[start:end])
+    deltas *= scale
+    return FlexFrames([name for name, _, _ in frames], offsets, indices, deltas)
+
+
+def merge_flex_frames(flex_frames: List[FlexFrames]) -> FlexFrames:
+    """Combines frames of several sub-meshes of one merged mesh, frames sharing a name become one frame."""
+    if len(flex_frames) == 1:
+        return flex_frames[0]
+    parts: Dict[str, List[Tuple[np.ndarray, np.ndarray]]] = defaultdict(list)
+    for frames in flex_frames:
+        for frame_id, name in enumerate(frames.names):
+            start, end = frames.offsets[frame_id], frames.offsets[frame_id + 1]
+            parts[name].append((frames.indices[start:end], frames.deltas[start:end]))
+    if not parts:
+        return flex_frames[0]
+
+    offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([sum(len(indices) for indices, _ in frame_parts) for frame_parts in parts.values()])
+    indices = np.concatenate([indices for frame_parts in parts.values() for indices, _ in frame_parts])
+    deltas = np.concatenate([deltas for frame_parts in parts.values() for _, deltas in frame_parts])
+    return FlexFrames(list(parts.keys()), offsets, indices, deltas)
+
+
+def build_shape_keys(mesh_obj: bpy.types.Object, flex_frames: FlexFrames, names=None):
+    mesh_data = mesh_obj.data
+    if mesh_data.shape_keys is None:
+        mesh_obj.shape_key_add(name='base')
+    key_blocks = mesh_data.shape_keys.key_blocks
+
+    base_pos = np.empty((len(mesh_data.vertices), 3), dtype=np.float32)
+    mesh_data.vertices.foreach_get('co', base_pos.reshape(-1))
+    # Every key is written from the same scratch buffer, only the touched rows are patched and restored
+    scratch = base_pos.copy()
+    for frame_id, name in enumerate(flex_frames.names):
+        if names is not None and name not in names:
+            continue
+        start, end = flex_frames.offsets[frame_id], flex_frames.offsets[frame_id + 1]
+        flex_indices = flex_frames.indices[start:end]
+        shape_key = key_blocks.get(name, None) or mesh_obj.shape_key_add(name=name)
+        scratch[flex_indices] += flex_frames.deltas[start:end]
+        shape_key.data.foreach_set("co", scratch.reshape(-1))
+        scratch[flex_indices] = base_pos[flex_indices]
+
+
+def store_sparse_flexes(mesh_data: bpy.types.Mesh, flex_frames: FlexFrames):
+    # ID property arrays can't hold strings, so names are stored as one newline separated string
+    mesh_data['pragma_flexes'] = {
+        'names': '\n'.join(flex_frames.names),
+        'offsets': flex_frames.offsets.astype(np.int32),
+        'indices': flex_frames.indices.astype(np.int32),
+        'deltas': flex_frames.deltas.reshape(-1),
+    }
+
+
+def load_sparse_flexes(mesh_data: bpy.types.Mesh) -> Optional[FlexFrames]:
+    stored = mesh_data.get('pragma_flexes', None)
+    if stored is None:
+        return None
+    names = stored['names'].split('\n') if stored['names'] else []
+    return FlexFrames(names,
+                      np.asarray(stored['offsets'], dtype=np.int64),
+                      np.asarray(stored['indices'], dtype=np.int32),
+                      np.asarray(stored['deltas'], dtype=np.float32).reshape((-1, 3)))
+
+
+def sparse_flex_names(mesh_data: bpy.types.Mesh) -> List[str]:
+    stored = mesh_data.get('pragma_flexes', None)
+    if stored is None or not stored['names']:
+        return []
+    return stored['names'].split('\n')
+
+
+def materialize_flexes(mesh_obj: bpy.types.Object, patterns: List[str]):
+    flex_frames = load_sparse_flexes(mesh_obj.data)
+    if flex_frames is None:
+        return []
+    names = [name for name in flex_frames.names if any(fnmatch(name, pattern) for pattern in patterns)]
+    build_shape_keys(mesh_obj, flex_frames, set(names))
+    return names
 
 
 class PMDLLoader:
 
-    def __init__(self, path: Path, scale=1.0, parent_collection=None, no_collections=False):
+    def __init__(self, path: Path, scale=1.0, parent_collection=None, no_collections=False, sparse_flexes=False,
+                 share_armature=False, merge_mode='NONE'):
         self.path = path
         self.scale = scale
+        # 'NONE' keeps one object per sub-mesh, 'MESH' merges the sub-meshes of each mesh,
+        # 'MESH_GROUP' merges everything in a mesh group
+        self.merge_mode = merge_mode
+        self.sparse_flexes = sparse_flexes
+        self.share_armature = share_armature
         self._udm_file = UDM()
         assert self._udm_file.load(path), f'Failed to load "{path}"'
         self.root = self._udm_file.root
@@ -25,6 +161,7 @@ class PMDLLoader:
         self._object_by_meshgroup = defaultdict(list)
         self._objects = []
         self._bone_names = {}
+        self._flex_index: Optional[Dict[Tuple[int, int, int], List[Tuple[str, ElementProperty]]]] = None
         self._master_collection = (get_new_unique_collection(self.model_name + '_model',
                                                              parent_collection or bpy.context.scene.collection)
                                    if not no_collections else parent_collection)
@@ -50,21 +187,13 @@ class PMDLLoader:
         return self.path.stem
 
     def load_armature(self):
-        self._bone_names, self._armature_obj = import_pskel(self.model_name, self.root['skeleton'], self.scale)
+        self._bone_names, self._armature_obj = import_pskel(self.model_name, self.root['skeleton'], self.scale,
+                                                                self.share_armature)
 
     def _find_flexes_by_ids(self, mesh_group_id: int, mesh_id: int, sub_mesh_id: int):
-        if 'morphTargetAnimations' in self.root:
-            flexes = []
-            for flex in self.root['morphTargetAnimations'].values():
-                assert flex['assetType'] == "PMORPHANI"
-                flex_data = flex['assetData']
-                for mesh_anim in flex_data['meshAnimations']:
-                    if (mesh_anim['meshGroup'] == mesh_group_id and
-                            mesh_anim['mesh'] == mesh_id and
-                            mesh_anim['subMesh'] == sub_mesh_id):
-                        flexes.append((flex_data['name'], mesh_anim))
-            return flexes
-        return []
+        if self._flex_index is None:
+            self._flex_index = build_flex_index(self.root)
+        return self._flex_index.get((mesh_group_id, mesh_id, sub_mesh_id), [])
 
     def load_mesh(self):
         mesh_groups = {mesh_group['index']: mesh_group for mesh_group_name, mesh_group in
@@ -81,49 +210,63 @@ class PMDLLoader:
 
     def _load_mesh_group(self, mesh_group, scale):
         mesh_group_id = mesh_group['index']
+        batches = defaultdict(list)
         for mesh_id, mesh in enumerate(mesh_group['meshes']):
             for sub_mesh_id, sub_mesh in enumerate(mesh['subMeshes']):
-                sub_mesh_prefix = f'{mesh_group.name}_{mesh_id}'
-                mesh_obj = import_pmesh(sub_mesh_prefix, sub_mesh, self.root, self._bone_names, scale)
-                mesh_data = mesh_obj.data
+                if self.merge_mode == 'MESH_GROUP':
+                    key = mesh_group.name
+                elif self.merge_mode == 'MESH':
+                    key = f'{mesh_group.name}_{mesh_id}'
+                else:
+                    key = (mesh_id, sub_mesh_id)
+                batches[key].append((mesh_id, sub_mesh_id, sub_mesh))
+
+        for key, batch in batches.items():
+            sub_meshes = [read_pmesh(sub_mesh, self.root, scale) for _, _, sub_mesh in batch]
+            if isinstance(key, str):
+                name = key
+            else:
+                name = f'{mesh_group.name}_{key[0]}_{sub_meshes[0].material_name}'
+            mesh_obj = build_pmesh_object(name, sub_meshes, self._bone_names)
+
+            flex_frames = []
+            vertex_offset = 0
+            for (mesh_id, sub_mesh_id, _), sub_mesh in zip(batch, sub_meshes):
                 flexes = self._find_flexes_by_ids(mesh_group_id, mesh_id, sub_mesh_id)
                 if len(flexes) > 0:
-                    vertices: np.ndarray = sub_mesh['assetData/vertices']
-                    pos = transform_vec3_array(vertices['pos'], ROTN90_X)
-                    mesh_obj.shape_key_add(name='base')
-                    for flex_name, flex_data in flexes:
-                        if flex_data['mesh'] != mesh_id or flex_data['subMesh'] != sub_mesh_id:
-                            continue
-                        flex_name = flex_name.replace('flex_', '')
-                        multi_frame_mode = len(flex_data['frames']) > 0
-                        for frame_num, frame in enumerate(flex_data['frames']):
-                            flex_indices = frame['vertexIndices']
-                            attribs = {attr['property']: attr['values'] for attr in frame['attributes']}
-                            assert 'position' in attribs, f'Missing position attribute on ' \
-                                                          f'"{flex_name}[{frame_num}]"'
-                            full_flex_name = f"{flex_name}[{frame_num}]" if not multi_frame_mode else flex_name
-                            shape_key = (mesh_data.shape_keys.key_blocks.get(full_flex_name, None) or
-                                         mesh_obj.shape_key_add(name=full_flex_name))
-                            flex_pos = pos.copy()
-                            position_ = attribs['position'].value()
-                            flex_pos[flex_indices] += transform_vec3_array(
-                                position_.view(np.float16).reshape((-1, 4))[:, :3], ROTN90_X)
-                            flex_pos *= scale
-                            shape_key.data.foreach_set("co", flex_pos.reshape(-1))
-
-                self._object_by_meshgroup[mesh_group_id].append(mesh_obj)
-                self._objects.append(mesh_obj)
-
-    def load_textures(self):
+                    flex_frames.append(decode_flex_frames(flexes, scale, vertex_offset))
+                vertex_offset += len(sub_mesh.positions)
+            if flex_frames:
+                flex_frames = merge_flex_frames(flex_frames)
+                if self.sparse_flexes:
+                    store_sparse_flexes(mesh_obj.data, flex_frames)
+                else:
+                    build_shape_keys(mesh_obj, flex_frames)
+
+            self._object_by_meshgroup[mesh_group_id].append(mesh_obj)
+            self._objects.append(mesh_obj)
+
+    def load_textures(self, load_images=True):
         cm = ContentManager()
-        for mat_root in self.root['materialPaths']:
-            for mat in self.root['materials']:
-                mat_path = cm.find_path(Path('materials') / mat_root / mat, extension='.pmat')
-                if mat_path:
-                    udm_mat = UDM()
-                    udm_mat.load(mat_path)
-                    import_pmat(udm_mat.root, mat)
-        pass
+        mat_roots = list(self.root['materialPaths'])
+        winning_roots = _material_roots.setdefault(str(self.path.absolute()), {})
+        reused = []
+        for mat in self.root['materials']:
+            # Start with the root this material was found in last time, the rest keep the model's order
+            roots = mat_roots
+            if winning_roots.get(mat, None) in mat_roots:
+                roots = [winning_roots[mat]] + [root for root in mat_roots if root != winning_roots[mat]]
+            root_id, mat_path = cm.find_first_path((Path(mat_root) / mat for mat_root in roots), 'materials',
+                                                   '.pmat')
+            if mat_path is None:
+                continue
+            winning_roots[mat] = roots[root_id]
+            if import_pmat_file(mat_path, mat) == 'REUSED':
+                reused.append(mat)
+        if reused:
+            print(f'Reused {len(reused)} already imported materials: {", ".join(reused)}')
+        if load_images:
+            ImageRegistry().load_pending()
 
     def finalize(self, no_collections=False):
         if self._armature_obj:
@@ -151,11 +294,13 @@ class PMDLLoader:
         pass
 
 
-def import_pmdl(path: Path, scale=1.0, parent_collection=None, no_collections=False):
-    loader = PMDLLoader(path, scale, parent_collection)
+def import_pmdl(path: Path, scale=1.0, parent_collection=None, no_collections=False, load_images=True,
+                sparse_flexes=False, share_armature=False, merge_mode='NONE'):
+    loader = PMDLLoader(path, scale, parent_collection, sparse_flexes=sparse_flexes, share_armature=share_armature,
+                        merge_mode=merge_mode)
     loader.load_armature()
     loader.load_mesh()
-    loader.load_textures()
+    loader.load_textures(load_images)
     loader.finalize(no_collections)
     loader.cleanup()
     return loader
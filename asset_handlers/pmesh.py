@@ -1,13 +1,35 @@
-from typing import Dict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
 
 import bpy
 import numpy as np
 
 from ..pragma_udm_wrapper.properties import ElementProperty
-from pragma_udm_io.utils import ROTN90_X, transform_vec3_array, get_material
+from pragma_udm_io.utils import ROTN90_X, transform_vec3_array, MaterialSlotIndex
+from pragma_udm_io.utils.mesh_utils import build_mesh, bucket_vertex_weights, DEFAULT_WEIGHT_STEP
 
 
-def import_pmesh(name_prefix, asset: ElementProperty, root: ElementProperty, bone_names: Dict[int, str], scale):
+def assign_vertex_weights(mesh_obj, bone_names: Dict[int, str], weights: np.ndarray, vertex_offset=0,
+                          weight_step=DEFAULT_WEIGHT_STEP):
+    weight_groups = {bone: (mesh_obj.vertex_groups.get(bone, None) or mesh_obj.vertex_groups.new(name=bone))
+                     for bone in bone_names.values()}
+    for bone_id, weight, vertex_ids in bucket_vertex_weights(weights['id'], weights['w'], vertex_offset,
+                                                             weight_step):
+        weight_groups[bone_names[bone_id]].add(vertex_ids.tolist(), weight, 'REPLACE')
+
+
+@dataclass(slots=True)
+class SubMeshData:
+    material_name: str
+    positions: np.ndarray
+    normals: np.ndarray
+    uvs: np.ndarray
+    indices: np.ndarray
+    alphas: Optional[np.ndarray] = None
+    weights: Optional[np.ndarray] = None
+
+
+def read_pmesh(asset: ElementProperty, root: ElementProperty, scale) -> SubMeshData:
     assert asset['assetType'] == 'PMESH'
     sub_mesh_data = asset['assetData']
     assert sub_mesh_data['geometryType'] == 'Triangles'
@@ -15,48 +37,54 @@ def import_pmesh(name_prefix, asset: ElementProperty, root: ElementProperty, bon
     vertices: np.ndarray = sub_mesh_data['vertices'].value()
     indices: np.ndarray = sub_mesh_data['indices'].value()
 
-    material_name = root['materials'][skin_id]
-    mesh_data = bpy.data.meshes.new(f'{name_prefix}_{material_name}_MESH')
-    mesh_obj = bpy.data.objects.new(f'{name_prefix}_{material_name}', mesh_data)
-    # pos = vertices['pos'] * scale
     pos = transform_vec3_array(vertices['pos'], ROTN90_X) * scale
-    mesh_data.from_pydata(pos, [], indices.reshape((-1, 3)).tolist())
-    mesh_data.update()
+    normals = transform_vec3_array(vertices['n'], ROTN90_X)
+    uvs = vertices['uv']
+    uvs[:, 1] = 1 - uvs[:, 1]
+    data = SubMeshData(root['materials'][skin_id], pos, normals, uvs, indices)
 
-    mesh_data.polygons.foreach_set("use_smooth", np.ones(len(mesh_data.polygons), np.bool))
+    if sub_mesh_data.get('alphaCount', 0) > 0:
+        data.alphas = sub_mesh_data['alphas'][:, 0]
+    if 'vertexWeights' in sub_mesh_data:
+        data.weights = sub_mesh_data['vertexWeights'].value()
+    return data
 
-    # normals = vertices['n']
-    normals = transform_vec3_array(vertices['n'], ROTN90_X)
-    mesh_data.normals_split_custom_set_from_vertices(normals)
-    mesh_data.use_auto_smooth = True
 
-    uv_data = mesh_data.uv_layers.new()
+def build_pmesh_object(name: str, sub_meshes: List[SubMeshData], bone_names: Dict[int, str]):
+    """Builds one mesh object out of one or more sub-meshes, each keeps its material as a polygon material index."""
+    mesh_data = bpy.data.meshes.new(f'{name}_MESH')
+    mesh_obj = bpy.data.objects.new(name, mesh_data)
 
-    vertex_indices = np.zeros((len(mesh_data.loops, )), dtype=np.uint32)
-    if sub_mesh_data.get('alphaCount', 0) > 0:
-        alpha_data = sub_mesh_data['alphas']
+    vertex_offsets = np.cumsum([0] + [len(sub_mesh.positions) for sub_mesh in sub_meshes])
+    if len(sub_meshes) == 1:
+        sub_mesh = sub_meshes[0]
+        positions, normals, uvs, indices = sub_mesh.positions, sub_mesh.normals, sub_mesh.uvs, sub_mesh.indices
+    else:
+        positions = np.concatenate([sub_mesh.positions for sub_mesh in sub_meshes])
+        normals = np.concatenate([sub_mesh.normals for sub_mesh in sub_meshes])
+        uvs = np.concatenate([sub_mesh.uvs for sub_mesh in sub_meshes])
+        indices = np.concatenate([sub_mesh.indices.astype(np.int32) + offset
+                                  for sub_mesh, offset in zip(sub_meshes, vertex_offsets)])
+    build_mesh(mesh_data, positions, indices, normals, uvs)
+
+    if any(sub_mesh.alphas is not None for sub_mesh in sub_meshes):
+        alphas = np.concatenate([sub_mesh.alphas if sub_mesh.alphas is not None else
+                                 np.ones(len(sub_mesh.positions), dtype=np.float32)
+                                 for sub_mesh in sub_meshes])
         vertex_colors = mesh_data.vertex_colors.get('alpha', False) or \
                         mesh_data.vertex_colors.new(name='alpha')
-        tmp = np.ones((len(vertex_indices), 4))
-        tmp[:, 3] = alpha_data[:, 0]
+        tmp = np.ones((len(indices), 4), dtype=np.float32)
+        tmp[:, 3] = alphas[indices]
         vertex_colors_data = vertex_colors.data
-        vertex_colors_data.foreach_set('color', tmp.flatten())
+        vertex_colors_data.foreach_set('color', tmp.reshape(-1))
 
-    mesh_data.loops.foreach_get('vertex_index', vertex_indices)
-    uvs = vertices['uv']
-    uvs[:, 1] = 1 - uvs[:, 1]
-    uv_data.data.foreach_set('uv', uvs[vertex_indices].flatten())
-    if 'vertexWeights' in sub_mesh_data and bone_names:
-        weight_groups = {bone: mesh_obj.vertex_groups.new(name=bone) for bone in
-                         bone_names.values()}
-        weights: np.ndarray = sub_mesh_data['vertexWeights'].value()
-        for n, weights in enumerate(weights):
-            for bone_index, weight in zip(weights['id'], weights['w']):
-                if weight >= 0 and bone_index >= 0:
-                    bone_name = bone_names[bone_index]
-                    weight_groups[bone_name].add([n], weight, 'REPLACE')
-
-    get_material(material_name, mesh_obj)
+    if bone_names:
+        for sub_mesh, offset in zip(sub_meshes, vertex_offsets):
+            if sub_mesh.weights is not None:
+                assign_vertex_weights(mesh_obj, bone_names, sub_mesh.weights, int(offset))
+
+    MaterialSlotIndex(mesh_data).assign([sub_mesh.material_name for sub_mesh in sub_meshes],
+                                        [len(sub_mesh.indices) // 3 for sub_mesh in sub_meshes])
 
     mesh_data.update()
 
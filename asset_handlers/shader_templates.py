@@ -0,0 +1,166 @@
+import bpy
+
+from ..utils.node import Nodes
+
+PBR_TEMPLATE = 'Pragma PBR'
+PBR_BLEND_TEMPLATE = 'Pragma PBR Blend'
+UNLIT_TEMPLATE = 'Pragma Unlit'
+WATER_TEMPLATE = 'Pragma Water'
+
+WHITE = (1.0, 1.0, 1.0, 1.0)
+# Principled BSDF base color default, used when a material has no albedo texture
+DEFAULT_ALBEDO = (0.8, 0.8, 0.8, 1.0)
+FLAT_NORMAL = (0.5, 0.5, 1.0, 1.0)
+# Green and blue give the Principled BSDF defaults (roughness 0.5, metallic 0) when no RMA map is connected
+DEFAULT_RMA = (1.0, 0.5, 0.0, 1.0)
+
+
+def _add_input(tree: bpy.types.ShaderNodeTree, socket_type: str, name: str, default_value=None):
+    socket = tree.inputs.new(socket_type, name)
+    if default_value is not None:
+        socket.default_value = default_value
+    return socket
+
+
+def _new_node(tree: bpy.types.ShaderNodeTree, node_type: str, location):
+    node = tree.nodes.new(node_type)
+    node.location = location
+    return node
+
+
+def _new_tree(name: str):
+    tree = bpy.data.node_groups.new(name, 'ShaderNodeTree')
+    tree.outputs.new('NodeSocketShader', 'BSDF')
+    group_input = _new_node(tree, 'NodeGroupInput', (-800, 0))
+    group_output = _new_node(tree, 'NodeGroupOutput', (600, 0))
+    return tree, group_input, group_output
+
+
+def _build_pbr():
+    tree, group_input, group_output = _new_tree(PBR_TEMPLATE)
+    _add_input(tree, 'NodeSocketColor', 'Albedo', DEFAULT_ALBEDO)
+    _add_input(tree, 'NodeSocketFloatFactor', 'Alpha', 1.0)
+    _add_input(tree, 'NodeSocketColor', 'Color Factor', WHITE)
+    _add_input(tree, 'NodeSocketColor', 'Normal', FLAT_NORMAL)
+    _add_input(tree, 'NodeSocketColor', 'RMA', DEFAULT_RMA)
+    _add_input(tree, 'NodeSocketFloat', 'Roughness Factor', 1.0)
+    _add_input(tree, 'NodeSocketFloat', 'Metalness Factor', 1.0)
+    _add_input(tree, 'NodeSocketColor', 'Emission', (0.0, 0.0, 0.0, 1.0))
+    _add_input(tree, 'NodeSocketFloat', 'Emission Strength', 1.0)
+    links = tree.links
+
+    shader = _new_node(tree, Nodes.ShaderNodeBsdfPrincipled, (300, 0))
+    links.new(shader.outputs['BSDF'], group_output.inputs['BSDF'])
+
+    color_mix = _new_node(tree, Nodes.ShaderNodeMixRGB, (-50, 250))
+    color_mix.blend_type = 'MULTIPLY'
+    color_mix.inputs['Fac'].default_value = 1.0
+    links.new(group_input.outputs['Albedo'], color_mix.inputs['Color1'])
+    links.new(group_input.outputs['Color Factor'], color_mix.inputs['Color2'])
+    links.new(color_mix.outputs['Color'], shader.inputs['Base Color'])
+    links.new(group_input.outputs['Alpha'], shader.inputs['Alpha'])
+
+    normal_map = _new_node(tree, Nodes.ShaderNodeNormalMap, (-50, 0))
+    links.new(group_input.outputs['Normal'], normal_map.inputs['Color'])
+    links.new(normal_map.outputs['Normal'], shader.inputs['Normal'])
+
+    rma_split = _new_node(tree, Nodes.ShaderNodeSeparateRGB, (-350, -250))
+    links.new(group_input.outputs['RMA'], rma_split.inputs['Image'])
+    for channel, factor_name, shader_input, y in (('G', 'Roughness Factor', 'Roughness', -250),
+                                                    ('B', 'Metalness Factor', 'Metallic', -400)):
+        multiply = _new_node(tree, Nodes.ShaderNodeMath, (-50, y))
+        multiply.operation = 'MULTIPLY'
+        links.new(rma_split.outputs[channel], multiply.inputs[0])
+        links.new(group_input.outputs[factor_name], multiply.inputs[1])
+        links.new(multiply.outputs[0], shader.inputs[shader_input])
+
+    links.new(group_input.outputs['Emission'], shader.inputs['Emission'])
+    links.new(group_input.outputs['Emission Strength'], shader.inputs['Emission Strength'])
+    return tree
+
+
+def _build_pbr_blend():
+    pbr = get_template(PBR_TEMPLATE)
+    tree, group_input, group_output = _new_tree(PBR_BLEND_TEMPLATE)
+    _add_input(tree, 'NodeSocketColor', 'Albedo', DEFAULT_ALBEDO)
+    _add_input(tree, 'NodeSocketColor', 'Albedo 2', DEFAULT_ALBEDO)
+    for socket in pbr.inputs[1:]:
+        _add_input(tree, socket.bl_socket_idname, socket.name, socket.default_value)
+    links = tree.links
+
+    vertex_color = _new_node(tree, Nodes.ShaderNodeVertexColor, (-400, 350))
+    vertex_color.layer_name = 'alpha'
+    mix = _new_node(tree, Nodes.ShaderNodeMixRGB, (-150, 250))
+    links.new(vertex_color.outputs['Alpha'], mix.inputs['Fac'])
+    links.new(group_input.outputs['Albedo'], mix.inputs['Color1'])
+    links.new(group_input.outputs['Albedo 2'], mix.inputs['Color2'])
+
+    shader = _new_node(tree, Nodes.ShaderNodeGroup, (200, 0))
+    shader.node_tree = pbr
+    links.new(mix.outputs['Color'], shader.inputs['Albedo'])
+    for socket in pbr.inputs[1:]:
+        links.new(group_input.outputs[socket.name], shader.inputs[socket.name])
+    links.new(shader.outputs['BSDF'], group_output.inputs['BSDF'])
+    return tree
+
+
+def _build_unlit():
+    tree, group_input, group_output = _new_tree(UNLIT_TEMPLATE)
+    _add_input(tree, 'NodeSocketColor', 'Albedo', DEFAULT_ALBEDO)
+    _add_input(tree, 'NodeSocketFloatFactor', 'Alpha', 1.0)
+    _add_input(tree, 'NodeSocketColor', 'Color Factor', WHITE)
+    # Only materials with an albedo map glow, the rest keep the plain grey base color
+    _add_input(tree, 'NodeSocketFloat', 'Emission Strength', 0.0)
+    links = tree.links
+
+    shader = _new_node(tree, Nodes.ShaderNodeBsdfPrincipled, (300, 0))
+    shader.inputs['Specular'].default_value = 0.0
+    links.new(shader.outputs['BSDF'], group_output.inputs['BSDF'])
+
+    color_mix = _new_node(tree, Nodes.ShaderNodeMixRGB, (-50, 250))
+    color_mix.blend_type = 'MULTIPLY'
+    color_mix.inputs['Fac'].default_value = 1.0
+    links.new(group_input.outputs['Albedo'], color_mix.inputs['Color1'])
+    links.new(group_input.outputs['Color Factor'], color_mix.inputs['Color2'])
+    links.new(color_mix.outputs['Color'], shader.inputs['Base Color'])
+    links.new(color_mix.outputs['Color'], shader.inputs['Emission'])
+    links.new(group_input.outputs['Emission Strength'], shader.inputs['Emission Strength'])
+    links.new(group_input.outputs['Alpha'], shader.inputs['Alpha'])
+    return tree
+
+
+def _build_water():
+    tree, group_input, group_output = _new_tree(WATER_TEMPLATE)
+    _add_input(tree, 'NodeSocketColor', 'Color', WHITE)
+    _add_input(tree, 'NodeSocketColor', 'Normal', FLAT_NORMAL)
+    links = tree.links
+
+    shader = _new_node(tree, Nodes.ShaderNodeBsdfPrincipled, (300, 0))
+    shader.inputs['Specular'].default_value = 0.5
+    shader.inputs['Roughness'].default_value = 0.035
+    shader.inputs['Transmission'].default_value = 1
+    links.new(group_input.outputs['Color'], shader.inputs['Base Color'])
+    links.new(shader.outputs['BSDF'], group_output.inputs['BSDF'])
+
+    normal_map = _new_node(tree, Nodes.ShaderNodeNormalMap, (-50, 0))
+    links.new(group_input.outputs['Normal'], normal_map.inputs['Color'])
+    links.new(normal_map.outputs['Normal'], shader.inputs['Normal'])
+    return tree
+
+
+TEMPLATE_BUILDERS = {
+    PBR_TEMPLATE: _build_pbr,
+    PBR_BLEND_TEMPLATE: _build_pbr_blend,
+    UNLIT_TEMPLATE: _build_unlit,
+    WATER_TEMPLATE: _build_water,
+}
+
+
+def get_template(name: str) -> bpy.types.ShaderNodeTree:
+    """Returns the shared node group for a shader archetype, building it on first use.
+    Existing groups are reused as is, so edits to them apply to every imported material.
+    """
+    tree = bpy.data.node_groups.get(name, None)
+    if tree is None:
+        tree = TEMPLATE_BUILDERS[name]()
+    return tree
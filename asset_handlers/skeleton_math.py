@@ -0,0 +1,151 @@
+from typing import List
+
+import numpy as np
+
+# Signed axis permutation applied by the old convert_matrix helper: (x, y, z) -> (x, -z, y)
+AXIS_CONVERSION = np.array([[1, 0, 0, 0],
+                            [0, 0, -1, 0],
+                            [0, 1, 0, 0],
+                            [0, 0, 0, 1]], dtype=np.float64)
+Y_AXIS = np.array([0.0, 1.0, 0.0])
+# Axis mathutils picks for a 180 degree turn away from +Y
+FLIP_AXIS = np.array([1.0, 0.0, 1.0]) / np.sqrt(2.0)
+
+
+def quaternion_to_matrix(quats: np.ndarray) -> np.ndarray:
+    """(N, 4) wxyz quaternions to (N, 3, 3) rotation matrices."""
+    quats = quats / np.linalg.norm(quats, axis=1, keepdims=True)
+    w, x, y, z = quats.T
+    return np.stack([
+        np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)], axis=-1),
+        np.stack([2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)], axis=-1),
+        np.stack([2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)], axis=-1),
+    ], axis=1)
+
+
+def compose_matrices(trans: np.ndarray, rot: np.ndarray) -> np.ndarray:
+    """Translation @ rotation for (N, 3) translations and (N, 3, 3) rotations."""
+    matrices = np.zeros((len(trans), 4, 4), dtype=np.float64)
+    matrices[:, :3, :3] = rot
+    matrices[:, :3, 3] = trans
+    matrices[:, 3, 3] = 1
+    return matrices
+
+
+def depth_levels(parents: np.ndarray) -> List[np.ndarray]:
+    """Groups bone ids by depth, parents are expected to come before their children."""
+    depth = np.zeros(len(parents), dtype=np.int32)
+    for bone_id, parent_id in enumerate(parents):
+        if parent_id >= 0:
+            depth[bone_id] = depth[parent_id] + 1
+    return [np.flatnonzero(depth == level) for level in range(depth.max(initial=-1) + 1)]
+
+
+def world_matrices(local: np.ndarray, parents: np.ndarray, levels: List[np.ndarray] = None) -> np.ndarray:
+    """Chains (N, 4, 4) parent space matrices, one batched matmul per hierarchy level."""
+    if levels is None:
+        levels = depth_levels(parents)
+    world = local.copy()
+    for level in levels[1:]:
+        world[level] = world[parents[level]] @ local[level]
+    return world
+
+
+def inverse_bind_matrices(poses: np.ndarray) -> np.ndarray:
+    """(N, 7) poses stored as position + xyzw rotation to Blender space inverse bind matrices."""
+    rot = quaternion_to_matrix(poses[:, [6, 3, 4, 5]])
+    pose_matrices = compose_matrices(poses[:, :3] / 40.0, rot)
+    inv_bind = AXIS_CONVERSION @ np.linalg.inv(pose_matrices) @ AXIS_CONVERSION.T
+    inv_bind[:, :3, 3] *= 4.0
+    return inv_bind
+
+
+def bind_local_transforms(poses: np.ndarray, parents: np.ndarray):
+    """Parent space translations (N, 3) and rotations (N, 3, 3) of the bind pose."""
+    inv_bind = inverse_bind_matrices(poses)
+    bind_local = inv_bind[np.maximum(parents, 0)] @ np.linalg.inv(inv_bind)
+    trans = bind_local[:, :3, 3].copy()
+    rot = bind_local[:, :3, :3].copy()
+
+    roots = parents < 0
+    trans[roots] = poses[roots, :3] * 4.0
+    rot[roots] = quaternion_to_matrix(poses[roots][:, [6, 3, 4, 5]])
+    return trans, rot
+
+
+def rotation_from_y(directions: np.ndarray) -> np.ndarray:
+    """Shortest arc rotations (N, 3, 3) turning +Y onto each direction, same degenerate cases as mathutils."""
+    lengths = np.linalg.norm(directions, axis=1, keepdims=True)
+    unit = np.divide(directions, lengths, out=np.zeros_like(directions), where=lengths > 0)
+    axis = np.cross(Y_AXIS, unit)
+    cos = unit[:, 1]
+
+    skew = np.zeros((len(unit), 3, 3), dtype=np.float64)
+    skew[:, 0, 1], skew[:, 0, 2] = -axis[:, 2], axis[:, 1]
+    skew[:, 1, 0], skew[:, 1, 2] = axis[:, 2], -axis[:, 0]
+    skew[:, 2, 0], skew[:, 2, 1] = -axis[:, 1], axis[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factor = (1.0 / (1.0 + cos))[:, None, None]
+        rot = np.eye(3) + skew + skew @ skew * factor
+
+    degenerate = np.linalg.norm(axis, axis=1) <= np.finfo(np.float32).eps
+    rot[degenerate & (cos > 0)] = np.eye(3)
+    rot[degenerate & (cos <= 0)] = 2 * np.outer(FLIP_AXIS, FLIP_AXIS) - np.eye(3)
+    return rot
+
+
+def snap_to_signed_permutation(rot: np.ndarray) -> np.ndarray:
+    """Returns signed permutation matrices close to (N, 3, 3) rotations.
+    (A signed permutation matrix is like a permutation matrix, except
+    the non-zero entries can be ±1.)
+    """
+    count = len(rot)
+    rows = np.arange(count)
+    magnitude = np.abs(rot)
+    # Largest entry in the first row, then the larger of the two columns left for the second one
+    i = np.argmax(magnitude[:, 0], axis=1)
+    next_col, last_col = (i + 1) % 3, (i + 2) % 3
+    j = np.where(magnitude[rows, 1, next_col] >= magnitude[rows, 1, last_col], next_col, last_col)
+    k = 3 - i - j
+
+    snapped = np.zeros_like(rot)
+    for row, col in enumerate((i, j, k)):
+        snapped[rows, row, col] = np.where(rot[rows, row, col] > 0, 1.0, -1.0)
+    return snapped
+
+
+def temperance(trans: np.ndarray, parents: np.ndarray) -> np.ndarray:
+    """Picks a rotation per bone that points its tip at the centroid of its children.
+    Leaf bones reuse the rotation of their parent, leaf roots are left as is.
+    """
+    count = len(parents)
+    has_parent = parents >= 0
+    child_count = np.bincount(parents[has_parent], minlength=count)
+    centroids = np.zeros((count, 3), dtype=np.float64)
+    np.add.at(centroids, parents[has_parent], trans[has_parent])
+
+    picked = np.broadcast_to(np.eye(3), (count, 3, 3)).copy()
+    internal = child_count > 0
+    # Snap to the local axes; keeps the edit bone rotation exact with non-uniform scaling
+    picked[internal] = snap_to_signed_permutation(rotation_from_y(centroids[internal]))
+    leaves = ~internal & has_parent
+    picked[leaves] = picked[parents[leaves]]
+    return picked
+
+
+def compute_edit_matrices(poses: np.ndarray, parents: np.ndarray) -> np.ndarray:
+    """Armature space edit bone matrices (N, 4, 4) for (N, 7) poses and parent ids (-1 for roots)."""
+    poses = np.asarray(poses, dtype=np.float64).reshape((-1, 7))
+    parents = np.asarray(parents, dtype=np.int64)
+    trans, rot = bind_local_transforms(poses, parents)
+
+    picked = temperance(trans, parents)
+    picked_inv = picked.transpose((0, 2, 1))
+    # Every bone is rotated by its picked rotation, children get the inverse applied so they stay in place
+    has_parent = parents >= 0
+    parent_inv = picked_inv[parents[has_parent]]
+    trans[has_parent] = (parent_inv @ trans[has_parent][:, :, None])[:, :, 0]
+    rot[has_parent] = parent_inv @ rot[has_parent]
+    rot = rot @ picked
+
+    return world_matrices(compose_matrices(trans, rot), parents)
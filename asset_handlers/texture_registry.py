@@ -0,0 +1,105 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from typing import Dict, Tuple
+
+import bpy
+
+from .vtf import load_texture
+from ..utils.singleton import SingletonMeta
+from ..utils.texture_utils import texture_from_data
+
+DECODED_TEXTURE_SUFFIXES = ('.vtf',)
+
+
+def _decode_file(path: Path):
+    try:
+        with path.open('rb') as file:
+            return load_texture(file)
+    except Exception as ex:
+        print(f'Caught exception "{ex}" while decoding "{path}"')
+        return None
+
+
+class ImageRegistry(metaclass=SingletonMeta):
+    def __init__(self):
+        # normalized resolved path -> (mtime_ns, image name)
+        self._images: Dict[str, Tuple[int, str]] = {}
+        # image name -> absolute path waiting to be decoded
+        self._pending: Dict[str, Path] = {}
+        self.max_workers = os.cpu_count() or 1
+
+    def get_image(self, path: Path, name: str) -> bpy.types.Image:
+        path = path.resolve()
+        # Symlinks, relative segments and case differences on Windows all map to one entry
+        key = os.path.normcase(str(path))
+        mtime = path.stat().st_mtime_ns
+        entry = self._images.get(key, None)
+        if entry is not None:
+            image = bpy.data.images.get(entry[1], None)
+            if image is not None:
+                if entry[0] != mtime:
+                    self._reload(image, path)
+                    self._images[key] = (mtime, image.name)
+                return image
+
+        image = bpy.data.images.get(name, None)
+        if image is None:
+            if path.suffix in DECODED_TEXTURE_SUFFIXES:
+                image = bpy.data.images.new(name, width=1, height=1, alpha=True)
+                self._pending[image.name] = path
+            else:
+                image = bpy.data.images.load(str(path), check_existing=True)
+                image.name = name
+        self._images[key] = (mtime, image.name)
+        return image
+
+    def _reload(self, image: bpy.types.Image, path: Path):
+        if path.suffix in DECODED_TEXTURE_SUFFIXES:
+            self._pending[image.name] = path
+        else:
+            image.reload()
+
+    @property
+    def pending_count(self):
+        return len(self._pending)
+
+    def load_pending(self):
+        pending = self._pending
+        self._pending = {}
+        if self.max_workers <= 1 or len(pending) <= 1:
+            for name, path in pending.items():
+                self._upload(name, path, _decode_file(path))
+            return
+        # Decoding happens on worker threads, only the bpy.data.images work stays on the main thread.
+        # Workers outrun the upload, so only a few decodes are kept in flight; otherwise every decoded
+        # RGBA buffer of the map would wait in a finished future and peak memory would scale with the
+        # texture count instead of the worker count.
+        workers = min(self.max_workers, len(pending))
+        max_in_flight = 2 * workers
+        queue = iter(pending.items())
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for name, path in queue:
+                futures[executor.submit(_decode_file, path)] = (name, path)
+                if len(futures) >= max_in_flight:
+                    break
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, path = futures.pop(future)
+                    self._upload(name, path, future.result())
+                    next_item = next(queue, None)
+                    if next_item is not None:
+                        futures[executor.submit(_decode_file, next_item[1])] = next_item
+
+    def _upload(self, name: str, path: Path, texture):
+        if texture is None:
+            print(f'Failed to decode "{path}"')
+            return
+        image_data, *image_dimm = texture
+        texture_from_data(name, image_data, image_dimm, True)
+
+    def clear(self):
+        self._images.clear()
+        self._pending.clear()
@@ -58,7 +58,8 @@ elif platform_name == 'Darwin':
         # Older macOSs. Not only is the name inconsistent but it's
         # not even in PATH.
         stdlib = ctypes.CDLL("/usr/lib/system/libsystem_c.dylib")
-    dll_close = stdlib.dlclose
+    dlclose_func = stdlib.dlclose
+    dlclose_func.argtypes = [ctypes.c_void_p]
 
 
     def free_lib(lib):
@@ -1,4 +1,9 @@
+import io
 import platform
+import struct
+import threading
+
+from .block_decoder import decode_texture, UnsupportedTextureFormat
 
 
 class UnsupportedOS(Exception):
@@ -22,26 +27,67 @@ if is_vtflib_supported():
     import numpy as np
     from .VTFWrapper import VTFLib
 
+    # VTFLib keeps its state in globals of the shared library, so one context is shared by the whole
+    # process and every decode goes through the same bound image slot.
+    _vtf_lib = None
+    _vtf_lib_lock = threading.RLock()
+
+
+    def get_vtf_lib():
+        global _vtf_lib
+        with _vtf_lib_lock:
+            if _vtf_lib is None:
+                _vtf_lib = VTFLib.VTFLib()
+            return _vtf_lib
+
+
+    def unload():
+        global _vtf_lib
+        with _vtf_lib_lock:
+            if _vtf_lib is not None:
+                _vtf_lib.unload()
+                _vtf_lib = None
 
-    def load_texture(file_object):
-        vtf_lib = VTFLib.VTFLib()
-        try:
-
-            vtf_lib.image_load_from_buffer(file_object.read())
-            if not vtf_lib.image_is_loaded():
-                raise Exception("Failed to load texture :{}".format(vtf_lib.get_last_error()))
-            image_width = vtf_lib.width()
-            image_height = vtf_lib.height()
-            image_byte_size = image_height * image_width * 4
-            rgba_data: np.ndarray = np.frombuffer(vtf_lib.convert_to_rgba8888().contents, dtype=np.uint8,
-                                                  count=image_byte_size)
-            rgba_data = rgba_data.reshape((image_height, image_width, 4))
-            rgba_data = np.flipud(rgba_data)
-            return rgba_data, image_width, image_height
-        except Exception as ex:
-            print(f'Caught exception "{ex}"')
-        finally:
-            vtf_lib.image_destroy()
+
+    def _load_texture_vtflib(file_object):
+        with _vtf_lib_lock:
+            try:
+                vtf_lib = get_vtf_lib()
+            except OSError as ex:
+                print(f'Failed to load VTFLib: "{ex}"')
+                return None
+            try:
+                vtf_lib.image_load_from_buffer(file_object.read())
+                if not vtf_lib.image_is_loaded():
+                    raise Exception("Failed to load texture :{}".format(vtf_lib.get_last_error()))
+                image_width = vtf_lib.width()
+                image_height = vtf_lib.height()
+                image_byte_size = image_height * image_width * 4
+                rgba_data: np.ndarray = np.frombuffer(vtf_lib.convert_to_rgba8888().contents, dtype=np.uint8,
+                                                      count=image_byte_size)
+                rgba_data = rgba_data.reshape((image_height, image_width, 4))
+                rgba_data = np.flipud(rgba_data)
+                return rgba_data, image_width, image_height
+            except Exception as ex:
+                print(f'Caught exception "{ex}"')
+            finally:
+                vtf_lib.image_destroy()
 else:
-    def load_texture(file_object):
+    def _load_texture_vtflib(file_object):
         return None
+
+
+    def unload():
+        pass
+
+
+def load_texture(file_object):
+    try:
+        return decode_texture(file_object)
+    except UnsupportedTextureFormat as ex:
+        print(f'Falling back to VTFLib: {ex}')
+    except (struct.error, ValueError, OSError, io.UnsupportedOperation) as ex:
+        # Truncated or corrupt files, and file objects that can't be memory mapped
+        print(f'Failed to decode texture, falling back to VTFLib: {ex}')
+    file_object.seek(0)
+    return _load_texture_vtflib(file_object)
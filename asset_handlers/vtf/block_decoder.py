@@ -0,0 +1,344 @@
+import struct
+from pathlib import Path
+from typing import Tuple, Union, BinaryIO
+
+import numpy as np
+
+
+class UnsupportedTextureFormat(Exception):
+    pass
+
+
+class VTFFormat:
+    RGBA8888 = 0
+    ABGR8888 = 1
+    RGB888 = 2
+    BGR888 = 3
+    I8 = 5
+    IA88 = 6
+    A8 = 8
+    ARGB8888 = 11
+    BGRA8888 = 12
+    DXT1 = 13
+    DXT3 = 14
+    DXT5 = 15
+    BGRX8888 = 16
+    DXT1_ONEBITALPHA = 20
+    UV88 = 22
+    ATI2N = 34
+    ATI1N = 35
+
+
+class BlockFormat:
+    DXT1 = 'DXT1'
+    DXT3 = 'DXT3'
+    DXT5 = 'DXT5'
+    BC4 = 'BC4'
+    BC5 = 'BC5'
+
+
+BLOCK_SIZES = {
+    BlockFormat.DXT1: 8,
+    BlockFormat.DXT3: 16,
+    BlockFormat.DXT5: 16,
+    BlockFormat.BC4: 8,
+    BlockFormat.BC5: 16,
+}
+
+# Uncompressed formats: bytes per pixel and the source channel feeding each of R, G, B, A (None = opaque/zero)
+PIXEL_LAYOUTS = {
+    'RGBA8888': (4, (0, 1, 2, 3)),
+    'RGBX8888': (4, (0, 1, 2, None)),
+    'ABGR8888': (4, (3, 2, 1, 0)),
+    'ARGB8888': (4, (1, 2, 3, 0)),
+    'BGRA8888': (4, (2, 1, 0, 3)),
+    'BGRX8888': (4, (2, 1, 0, None)),
+    'RGB888': (3, (0, 1, 2, None)),
+    'BGR888': (3, (2, 1, 0, None)),
+    'I8': (1, (0, 0, 0, None)),
+    'IA88': (2, (0, 0, 0, 1)),
+    'A8': (1, (None, None, None, 0)),
+    'UV88': (2, (0, 1, None, None)),
+}
+
+VTF_FORMATS = {
+    VTFFormat.RGBA8888: 'RGBA8888',
+    VTFFormat.ABGR8888: 'ABGR8888',
+    VTFFormat.RGB888: 'RGB888',
+    VTFFormat.BGR888: 'BGR888',
+    VTFFormat.I8: 'I8',
+    VTFFormat.IA88: 'IA88',
+    VTFFormat.A8: 'A8',
+    VTFFormat.ARGB8888: 'ARGB8888',
+    VTFFormat.BGRA8888: 'BGRA8888',
+    VTFFormat.BGRX8888: 'BGRX8888',
+    VTFFormat.UV88: 'UV88',
+    VTFFormat.DXT1: BlockFormat.DXT1,
+    VTFFormat.DXT1_ONEBITALPHA: BlockFormat.DXT1,
+    VTFFormat.DXT3: BlockFormat.DXT3,
+    VTFFormat.DXT5: BlockFormat.DXT5,
+    VTFFormat.ATI1N: BlockFormat.BC4,
+    VTFFormat.ATI2N: BlockFormat.BC5,
+}
+
+DDS_FOURCC_FORMATS = {
+    b'DXT1': BlockFormat.DXT1,
+    b'DXT2': BlockFormat.DXT3,
+    b'DXT3': BlockFormat.DXT3,
+    b'DXT4': BlockFormat.DXT5,
+    b'DXT5': BlockFormat.DXT5,
+    b'ATI1': BlockFormat.BC4,
+    b'BC4U': BlockFormat.BC4,
+    b'ATI2': BlockFormat.BC5,
+    b'BC5U': BlockFormat.BC5,
+}
+
+DXGI_FORMATS = {
+    28: 'RGBA8888',
+    29: 'RGBA8888',
+    71: BlockFormat.DXT1,
+    72: BlockFormat.DXT1,
+    74: BlockFormat.DXT3,
+    75: BlockFormat.DXT3,
+    77: BlockFormat.DXT5,
+    78: BlockFormat.DXT5,
+    80: BlockFormat.BC4,
+    83: BlockFormat.BC5,
+    87: 'BGRA8888',
+    88: 'BGRX8888',
+    91: 'BGRA8888',
+}
+
+VTF_ENVMAP_FLAG = 0x4000
+VTF_HIGH_RES_RESOURCE = b'\x30\x00\x00'
+DDS_ALPHA_PIXELS = 0x1
+DDS_FOURCC = 0x4
+
+
+def image_size(image_format: str, width: int, height: int) -> int:
+    if image_format in BLOCK_SIZES:
+        return max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * BLOCK_SIZES[image_format]
+    return width * height * PIXEL_LAYOUTS[image_format][0]
+
+
+def _unpack_565(colors: np.ndarray) -> np.ndarray:
+    colors = colors.astype(np.uint32)
+    rgb = np.empty(colors.shape + (3,), dtype=np.uint32)
+    rgb[..., 0] = (((colors >> 11) & 0x1F) * 527 + 23) >> 6
+    rgb[..., 1] = (((colors >> 5) & 0x3F) * 259 + 33) >> 6
+    rgb[..., 2] = ((colors & 0x1F) * 527 + 23) >> 6
+    return rgb
+
+
+def _decode_color_blocks(blocks: np.ndarray, four_color_only: bool) -> np.ndarray:
+    # blocks: (N, 8) uint8 -> (N, 16, 4) uint8
+    c0 = blocks[:, 0].astype(np.uint16) | (blocks[:, 1].astype(np.uint16) << 8)
+    c1 = blocks[:, 2].astype(np.uint16) | (blocks[:, 3].astype(np.uint16) << 8)
+    rgb0 = _unpack_565(c0)
+    rgb1 = _unpack_565(c1)
+
+    palette = np.empty((len(blocks), 4, 4), dtype=np.uint32)
+    palette[:, :, 3] = 255
+    palette[:, 0, :3] = rgb0
+    palette[:, 1, :3] = rgb1
+    four_color = (c0 > c1) if not four_color_only else np.ones(len(blocks), dtype=bool)
+    three_color = ~four_color
+    palette[four_color, 2, :3] = (2 * rgb0[four_color] + rgb1[four_color]) // 3
+    palette[four_color, 3, :3] = (rgb0[four_color] + 2 * rgb1[four_color]) // 3
+    palette[three_color, 2, :3] = (rgb0[three_color] + rgb1[three_color]) // 2
+    palette[three_color, 3] = 0
+
+    bits = blocks[:, 4:8].copy().view('<u4')[:, 0]
+    selectors = (bits[:, None] >> (2 * np.arange(16, dtype=np.uint32))) & 3
+    return np.take_along_axis(palette, selectors[:, :, None].astype(np.intp), axis=1).astype(np.uint8)
+
+
+def _decode_explicit_alpha_blocks(blocks: np.ndarray) -> np.ndarray:
+    bits = blocks[:, 0:8].copy().view('<u8')[:, 0]
+    alpha = (bits[:, None] >> (4 * np.arange(16, dtype=np.uint64))) & 0xF
+    return (alpha * 17).astype(np.uint8)
+
+
+def _decode_interpolated_alpha_blocks(blocks: np.ndarray) -> np.ndarray:
+    # BC4/DXT5 alpha block: (N, 8) uint8 -> (N, 16) uint8
+    a0 = blocks[:, 0].astype(np.uint32)
+    a1 = blocks[:, 1].astype(np.uint32)
+    palette = np.empty((len(blocks), 8), dtype=np.uint32)
+    palette[:, 0] = a0
+    palette[:, 1] = a1
+    eight_alpha = a0 > a1
+    six_alpha = ~eight_alpha
+    for i in range(1, 7):
+        palette[eight_alpha, i + 1] = ((7 - i) * a0[eight_alpha] + i * a1[eight_alpha]) // 7
+    for i in range(1, 5):
+        palette[six_alpha, i + 1] = ((5 - i) * a0[six_alpha] + i * a1[six_alpha]) // 5
+    palette[six_alpha, 6] = 0
+    palette[six_alpha, 7] = 255
+
+    raw = np.zeros((len(blocks), 8), dtype=np.uint8)
+    raw[:, :6] = blocks[:, 2:8]
+    bits = raw.view('<u8')[:, 0]
+    selectors = (bits[:, None] >> (3 * np.arange(16, dtype=np.uint64))) & 7
+    return np.take_along_axis(palette, selectors.astype(np.intp), axis=1).astype(np.uint8)
+
+
+def decode_blocks(data: np.ndarray, image_format: str, width: int, height: int) -> np.ndarray:
+    block_width = max(1, (width + 3) // 4)
+    block_height = max(1, (height + 3) // 4)
+    block_size = BLOCK_SIZES[image_format]
+    blocks = np.asarray(data[:block_width * block_height * block_size]).reshape((-1, block_size))
+
+    texels = np.empty((len(blocks), 16, 4), dtype=np.uint8)
+    if image_format == BlockFormat.DXT1:
+        texels[:] = _decode_color_blocks(blocks, False)
+    elif image_format == BlockFormat.DXT3:
+        texels[:] = _decode_color_blocks(blocks[:, 8:], True)
+        texels[:, :, 3] = _decode_explicit_alpha_blocks(blocks[:, :8])
+    elif image_format == BlockFormat.DXT5:
+        texels[:] = _decode_color_blocks(blocks[:, 8:], True)
+        texels[:, :, 3] = _decode_interpolated_alpha_blocks(blocks[:, :8])
+    elif image_format == BlockFormat.BC4:
+        red = _decode_interpolated_alpha_blocks(blocks)
+        texels[:, :, 0] = red
+        texels[:, :, 1] = red
+        texels[:, :, 2] = red
+        texels[:, :, 3] = 255
+    elif image_format == BlockFormat.BC5:
+        red = _decode_interpolated_alpha_blocks(blocks[:, :8])
+        green = _decode_interpolated_alpha_blocks(blocks[:, 8:])
+        texels[:, :, 0] = red
+        texels[:, :, 1] = green
+        # Two-channel normal maps: rebuild Z from the unit length constraint
+        x = red.astype(np.float32) / 127.5 - 1.0
+        y = green.astype(np.float32) / 127.5 - 1.0
+        z = np.sqrt(np.clip(1.0 - x * x - y * y, 0.0, 1.0))
+        texels[:, :, 2] = (z * 127.5 + 127.5).astype(np.uint8)
+        texels[:, :, 3] = 255
+    else:
+        raise UnsupportedTextureFormat(image_format)
+
+    rgba = texels.reshape((block_height, block_width, 4, 4, 4)).transpose((0, 2, 1, 3, 4))
+    rgba = rgba.reshape((block_height * 4, block_width * 4, 4))
+    return rgba[:height, :width]
+
+
+def decode_pixels(data: np.ndarray, image_format: str, width: int, height: int) -> np.ndarray:
+    pixel_size, channels = PIXEL_LAYOUTS[image_format]
+    pixels = np.asarray(data[:width * height * pixel_size]).reshape((height, width, pixel_size))
+    if channels == (0, 1, 2, 3):
+        return pixels
+    rgba = np.empty((height, width, 4), dtype=np.uint8)
+    for target, source in enumerate(channels):
+        if source is None:
+            rgba[:, :, target] = 255 if target == 3 else 0
+        else:
+            rgba[:, :, target] = pixels[:, :, source]
+    return rgba
+
+
+def decode_image(data: np.ndarray, image_format: str, width: int, height: int) -> np.ndarray:
+    if image_format in BLOCK_SIZES:
+        return decode_blocks(data, image_format, width, height)
+    if image_format in PIXEL_LAYOUTS:
+        return decode_pixels(data, image_format, width, height)
+    raise UnsupportedTextureFormat(image_format)
+
+
+def _check_size(data: np.ndarray, size: int, what: str):
+    if len(data) < size:
+        raise ValueError(f'Truncated texture: {what} needs {size} bytes, file has {len(data)}')
+
+
+def _read_vtf(data: np.ndarray) -> Tuple[np.ndarray, str, int, int]:
+    _check_size(data, 80, 'VTF header')
+    header = data[:80].tobytes()
+    major, minor, header_size = struct.unpack_from('<3I', header, 4)
+    width, height, flags, frames, first_frame = struct.unpack_from('<2HI2H', header, 16)
+    frames = max(frames, 1)
+    high_res_format, mipmap_count, low_res_format, low_res_width, low_res_height = struct.unpack_from(
+        '<iBi2B', header, 52)
+    depth = struct.unpack_from('<H', header, 63)[0] if (major, minor) >= (7, 2) else 1
+    depth = max(depth, 1)
+
+    if high_res_format not in VTF_FORMATS:
+        raise UnsupportedTextureFormat(f'VTF format {high_res_format}')
+    image_format = VTF_FORMATS[high_res_format]
+
+    faces = 1
+    if flags & VTF_ENVMAP_FLAG:
+        faces = 7 if (major, minor) < (7, 5) and first_frame != 0xFFFF else 6
+
+    if (major, minor) >= (7, 3):
+        resource_count = struct.unpack_from('<I', header, 68)[0]
+        _check_size(data, 80 + resource_count * 8, 'VTF resource directory')
+        resources = data[80:80 + resource_count * 8].tobytes()
+        for i in range(resource_count):
+            tag, _, offset = struct.unpack_from('<3sBI', resources, i * 8)
+            if tag == VTF_HIGH_RES_RESOURCE:
+                data_offset = offset
+                break
+        else:
+            raise UnsupportedTextureFormat('VTF without high resolution image data')
+    else:
+        data_offset = header_size
+        if low_res_format in VTF_FORMATS and low_res_width and low_res_height:
+            data_offset += image_size(VTF_FORMATS[low_res_format], low_res_width, low_res_height)
+
+    # Mips are stored smallest first, the full resolution image of frame 0, face 0, slice 0 comes last
+    for mip in range(mipmap_count - 1, 0, -1):
+        mip_width = max(1, width >> mip)
+        mip_height = max(1, height >> mip)
+        mip_depth = max(1, depth >> mip)
+        data_offset += image_size(image_format, mip_width, mip_height) * frames * faces * mip_depth
+
+    data_end = data_offset + image_size(image_format, width, height)
+    _check_size(data, data_end, 'VTF image data')
+    return data[data_offset:data_end], image_format, width, height
+
+
+def _read_dds(data: np.ndarray) -> Tuple[np.ndarray, str, int, int]:
+    _check_size(data, 128, 'DDS header')
+    header = data[:148].tobytes()
+    height, width = struct.unpack_from('<2I', header, 12)
+    pf_flags, fourcc, bit_count, r_mask, g_mask, b_mask, a_mask = struct.unpack_from('<I4s5I', header, 80)
+    data_offset = 128
+    if pf_flags & DDS_FOURCC:
+        if fourcc == b'DX10':
+            _check_size(data, 148, 'DDS DX10 header')
+            dxgi_format = struct.unpack_from('<I', header, 128)[0]
+            data_offset += 20
+            if dxgi_format not in DXGI_FORMATS:
+                raise UnsupportedTextureFormat(f'DXGI format {dxgi_format}')
+            image_format = DXGI_FORMATS[dxgi_format]
+        elif fourcc in DDS_FOURCC_FORMATS:
+            image_format = DDS_FOURCC_FORMATS[fourcc]
+        else:
+            raise UnsupportedTextureFormat(f'DDS fourcc {fourcc!r}')
+    elif bit_count == 32 and r_mask == 0x000000FF:
+        image_format = 'RGBA8888' if pf_flags & DDS_ALPHA_PIXELS else 'RGBX8888'
+    elif bit_count == 32 and r_mask == 0x00FF0000:
+        image_format = 'BGRA8888' if pf_flags & DDS_ALPHA_PIXELS else 'BGRX8888'
+    elif bit_count == 24 and r_mask == 0x00FF0000:
+        image_format = 'BGR888'
+    elif bit_count == 24 and r_mask == 0x000000FF:
+        image_format = 'RGB888'
+    else:
+        raise UnsupportedTextureFormat(f'DDS pixel format {bit_count}bpp {r_mask:08X}')
+    # DDS stores the full resolution image first
+    data_end = data_offset + image_size(image_format, width, height)
+    _check_size(data, data_end, 'DDS image data')
+    return data[data_offset:data_end], image_format, width, height
+
+
+def decode_texture(file: Union[str, Path, BinaryIO]):
+    data = np.memmap(file, dtype=np.uint8, mode='r')
+    magic = data[:4].tobytes()
+    if magic == b'VTF\x00':
+        image_data, image_format, width, height = _read_vtf(data)
+    elif magic == b'DDS ':
+        image_data, image_format, width, height = _read_dds(data)
+    else:
+        raise UnsupportedTextureFormat(f'Unknown texture signature {magic!r}')
+    rgba_data = decode_image(image_data, image_format, width, height)
+    rgba_data = np.flipud(rgba_data)
+    return rgba_data, width, height
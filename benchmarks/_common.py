@@ -0,0 +1,29 @@
+import importlib.util
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def load_module(relative_path: str):
+    """Loads one add-on module by file path, skipping the package __init__ files that import bpy.
+    Only works for modules without relative imports.
+    """
+    path = ROOT / relative_path
+    spec = importlib.util.spec_from_file_location(path.stem, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def timed(label: str, func, *args, repeats=1, detail=None):
+    """Runs func(*args) repeats times, prints the mean time and returns the last result.
+    detail(result) can add a few words to the printed line.
+    """
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = func(*args)
+    elapsed = (time.perf_counter() - start) / repeats
+    suffix = f' {detail(result)}' if detail is not None else ''
+    print(f'{label:<24} {elapsed * 1000:9.3f} ms{suffix}')
+    return result
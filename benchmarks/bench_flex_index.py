@@ -0,0 +1,66 @@
+"""Times the per sub mesh flex scan against the one pass flex index on a synthetic model root.
+The root is plain dicts shaped like a PMDL, so no Blender or UDM is needed.
+
+    python benchmarks/bench_flex_index.py
+"""
+import random
+
+from _common import load_module, timed
+
+FLEX_COUNT = 300
+MESH_GROUP_COUNT = 4
+MESHES_PER_GROUP = 5
+SUB_MESHES_PER_MESH = 2
+SUB_MESHES_PER_FLEX = 4
+REPEATS = 20
+
+
+def make_root(rng):
+    sub_meshes = [(group, mesh, sub_mesh)
+                  for group in range(MESH_GROUP_COUNT)
+                  for mesh in range(MESHES_PER_GROUP)
+                  for sub_mesh in range(SUB_MESHES_PER_MESH)]
+    flexes = {}
+    for flex_id in range(FLEX_COUNT):
+        mesh_anims = [{'meshGroup': group, 'mesh': mesh, 'subMesh': sub_mesh}
+                      for group, mesh, sub_mesh in rng.sample(sub_meshes, SUB_MESHES_PER_FLEX)]
+        flexes[f'flex_{flex_id}'] = {'assetType': 'PMORPHANI',
+                                     'assetData': {'name': f'flex_{flex_id}', 'meshAnimations': mesh_anims}}
+    return {'morphTargetAnimations': flexes}, sub_meshes
+
+
+def find_flexes_by_scan(root, mesh_group_id, mesh_id, sub_mesh_id):
+    # Lookup used before the index, one walk over every flex per sub mesh
+    if 'morphTargetAnimations' in root:
+        flexes = []
+        for flex in root['morphTargetAnimations'].values():
+            assert flex['assetType'] == "PMORPHANI"
+            flex_data = flex['assetData']
+            for mesh_anim in flex_data['meshAnimations']:
+                if (mesh_anim['meshGroup'] == mesh_group_id and
+                        mesh_anim['mesh'] == mesh_id and
+                        mesh_anim['subMesh'] == sub_mesh_id):
+                    flexes.append((flex_data['name'], mesh_anim))
+        return flexes
+    return []
+
+
+def scan_all(root, sub_meshes, flex_index_module):
+    return [find_flexes_by_scan(root, *ids) for ids in sub_meshes]
+
+
+def index_all(root, sub_meshes, flex_index_module):
+    flex_index = flex_index_module.build_flex_index(root)
+    return [flex_index.get(ids, []) for ids in sub_meshes]
+
+
+def main():
+    flex_index_module = load_module('asset_handlers/flex_index.py')
+    root, sub_meshes = make_root(random.Random(0))
+    print(f'{FLEX_COUNT} flexes, {len(sub_meshes)} sub meshes, {SUB_MESHES_PER_FLEX} sub meshes per flex')
+    expected = timed('scan', scan_all, root, sub_meshes, flex_index_module, repeats=REPEATS)
+    assert timed('index', index_all, root, sub_meshes, flex_index_module, repeats=REPEATS) == expected
+
+
+if __name__ == '__main__':
+    main()
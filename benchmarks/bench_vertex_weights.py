@@ -0,0 +1,72 @@
+"""Times per influence VertexGroup.add calls against bucketed ones on a synthetic skinned mesh.
+Runs with plain NumPy, the vertex groups only count calls and assigned vertices.
+
+    python benchmarks/bench_vertex_weights.py
+"""
+import numpy as np
+
+from _common import load_module, timed
+
+VERTEX_COUNT = 100_000
+INFLUENCE_COUNT = 4
+BONE_COUNT = 64
+
+
+class CountingVertexGroup:
+    def __init__(self):
+        self.calls = 0
+        self.assigned = 0
+
+    def add(self, index, weight, type):
+        self.calls += 1
+        self.assigned += len(index)
+
+
+def make_weights(rng):
+    weights = np.zeros(VERTEX_COUNT, dtype=[('id', np.int32, INFLUENCE_COUNT), ('w', np.float32, INFLUENCE_COUNT)])
+    weights['id'] = rng.integers(0, BONE_COUNT, (VERTEX_COUNT, INFLUENCE_COUNT))
+    raw = rng.random((VERTEX_COUNT, INFLUENCE_COUNT), dtype=np.float32)
+    weights['w'] = raw / raw.sum(axis=1, keepdims=True)
+    # Unused influence slots are stored as -1
+    unused = rng.random((VERTEX_COUNT, INFLUENCE_COUNT)) < 0.2
+    weights['id'][unused] = -1
+    weights['w'][unused] = -1
+    return weights
+
+
+def assign_per_influence(groups, weights):
+    for n, vertex_weights in enumerate(weights):
+        for bone_index, weight in zip(vertex_weights['id'], vertex_weights['w']):
+            if weight >= 0 and bone_index >= 0:
+                groups[bone_index].add([n], weight, 'REPLACE')
+
+
+def assign_bucketed(groups, weights, mesh_utils, weight_step):
+    for bone_id, weight, vertex_ids in mesh_utils.bucket_vertex_weights(weights['id'], weights['w'], 0,
+                                                                        weight_step):
+        groups[bone_id].add(vertex_ids.tolist(), weight, 'REPLACE')
+
+
+def assign(func, *args):
+    groups = {bone_id: CountingVertexGroup() for bone_id in range(BONE_COUNT)}
+    func(groups, *args)
+    return (sum(group.calls for group in groups.values()),
+            sum(group.assigned for group in groups.values()))
+
+
+def _counts(result):
+    return f'{result[0]:9} add calls {result[1]:9} influences'
+
+
+def main():
+    mesh_utils = load_module('utils/mesh_utils.py')
+    weights = make_weights(np.random.default_rng(0))
+    print(f'{VERTEX_COUNT} vertices, {INFLUENCE_COUNT} influences, {BONE_COUNT} bones')
+    _, expected = timed('per influence', assign, assign_per_influence, weights, detail=_counts)
+    for label, step in (('bucketed, exact', 0), ('bucketed, 1/255 step', mesh_utils.DEFAULT_WEIGHT_STEP)):
+        _, assigned = timed(label, assign, assign_bucketed, weights, mesh_utils, step, detail=_counts)
+        assert assigned == expected
+
+
+if __name__ == '__main__':
+    main()
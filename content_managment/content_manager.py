@@ -1,8 +1,9 @@
 import logging
-from functools import lru_cache
 from pathlib import Path
-from typing import Union, Dict, TypeVar, Optional
+from typing import Union, Dict, TypeVar, Optional, Iterable
 
+from pragma_udm_io.content_managment.path_index import PathIndex
+from pragma_udm_io.content_managment.resolver_cache import ResolverCache
 from pragma_udm_io.content_managment.providers.icontent_provider import IContentProvider
 from pragma_udm_io.content_managment.providers.root_provider import RootDirectoryProvider
 from pragma_udm_io.content_managment.providers.addon_provider import AddonProvider
@@ -19,14 +20,46 @@ class ContentManager(metaclass=SingletonMeta):
         self.content_providers: Dict[str, AnyContentProvider] = {}
         self.root_provider: Optional[AnyContentProvider] = None
         self.root_path: Optional[Path] = None
+        self.path_index: Optional[PathIndex] = None
+        self.resolver_cache = ResolverCache()
 
-        self._path_cache = {}
-
-    def set_root(self, root: Path):
-        self.root_path = Path(root)
+    def set_root(self, root: Path, path_index_file: Optional[Path] = None, *, use_path_index=False):
+        root = Path(root)
+        if root != self.root_path:
+            # Imported here, the asset handlers depend on the content manager
+            from pragma_udm_io.asset_handlers.pmdl import clear_material_roots
+            self.resolver_cache.clear()
+            # Material roots remembered for models of another game root don't apply to this one
+            clear_material_roots()
+        else:
+            # Files may have been added since the previous import, so only known paths are kept
+            self.resolver_cache.clear_negative()
+        self.root_path = root
         self.root_provider = RootDirectoryProvider(self.root_path)
         for addon in (self.root_path / 'addons').iterdir():
             self.content_providers[addon.stem] = AddonProvider(addon)
+        if use_path_index:
+            self.update_path_index(path_index_file)
+        else:
+            self.path_index = None
+
+    def update_path_index(self, path_index_file: Optional[Path] = None):
+        if self.path_index is None or self.path_index.cache_file != path_index_file:
+            self.path_index = PathIndex(path_index_file)
+        self.path_index.update(self.root_provider.root, exclude=('addons',))
+        for content_provider in self.content_providers.values():
+            self.path_index.update(content_provider.root)
+        self.path_index.save()
+
+    def _provider_find_path(self, content_provider: IContentProvider, filepath: Path):
+        if self.path_index is not None and self.path_index.has_root(content_provider.root):
+            return self.path_index.find(content_provider.root, filepath)
+        return content_provider.find_path(filepath)
+
+    def _provider_glob(self, content_provider: IContentProvider, pattern: str):
+        if self.path_index is not None and self.path_index.has_root(content_provider.root):
+            return self.path_index.glob(content_provider.root, pattern)
+        return content_provider.glob(pattern)
 
     def register_content_provider(self, name: str, content_provider: AnyContentProvider):
         if name in self.content_providers:
@@ -45,39 +78,87 @@ class ContentManager(metaclass=SingletonMeta):
 
     def glob(self, pattern: str):
         for content_provider in self.content_providers.values():
-            yield from content_provider.glob(pattern)
-        yield from self.root_provider.glob(pattern)
+            yield from self._provider_glob(content_provider, pattern)
+        yield from self._provider_glob(self.root_provider, pattern)
 
     def find_file(self, filepath: Union[str, Path], additional_dir=None, extension=None, *, silent=False):
         raise NotImplementedError('Don\'t use this function')
 
-    @lru_cache(128)
-    def find_path(self, filepath: Union[str, Path], additional_dir=None, extension=None, *, silent=False):
+    @staticmethod
+    def _request_path(filepath: Union[str, Path], additional_dir=None, extension=None):
         new_filepath = Path(str(filepath).strip('/\\').rstrip('/\\'))
         if additional_dir:
             new_filepath = Path(additional_dir, new_filepath)
         if extension:
             new_filepath = new_filepath.with_suffix(extension)
+        return new_filepath
+
+    def find_path(self, filepath: Union[str, Path], additional_dir=None, extension=None, *, silent=False):
+        new_filepath = self._request_path(filepath, additional_dir, extension)
         if not silent:
             logger.info(f'Requesting {new_filepath} file')
 
-        path = self._path_cache.get(new_filepath, -1)
-        if path != -1:
+        path = self.resolver_cache.get(new_filepath)
+        if path is not ResolverCache.MISS:
             return path
         for mod, submanager in self.content_providers.items():
-            file = (submanager.find_path(new_filepath) or
-                    submanager.find_path(new_filepath.with_suffix(new_filepath.suffix + '_b')))
+            file = (self._provider_find_path(submanager, new_filepath) or
+                    self._provider_find_path(submanager, new_filepath.with_suffix(new_filepath.suffix + '_b')))
             if file is not None:
                 if not silent:
                     logger.debug(f'Found in {mod}!')
-                self._path_cache[new_filepath] = file
+                self.resolver_cache.put(new_filepath, file)
                 return file
-        file = (self.root_provider.find_path(new_filepath) or
-                self.root_provider.find_path(new_filepath.with_suffix(new_filepath.suffix + '_b')))
-        self._path_cache[new_filepath] = file
+        file = (self._provider_find_path(self.root_provider, new_filepath) or
+                self._provider_find_path(self.root_provider, new_filepath.with_suffix(new_filepath.suffix + '_b')))
+        self.resolver_cache.put(new_filepath, file)
         return file
 
+    def find_first_path(self, filepaths: Iterable[Union[str, Path]], additional_dir=None, extension=None):
+        """Returns (index, path) of the first candidate that resolves, or (None, None) if none do."""
+        providers = [*self.content_providers.values(), self.root_provider]
+        if self.path_index is None or not all(self.path_index.has_root(cp.root) for cp in providers):
+            for i, filepath in enumerate(filepaths):
+                path = self.find_path(filepath, additional_dir, extension, silent=True)
+                if path is not None:
+                    return i, path
+            return None, None
+
+        candidates = [self._request_path(filepath, additional_dir, extension) for filepath in filepaths]
+        first, found = len(candidates), None
+        unresolved = []
+        for i, candidate in enumerate(candidates):
+            path = self.resolver_cache.get(candidate)
+            if path is ResolverCache.MISS:
+                unresolved.append(i)
+            elif path is not None:
+                first, found = i, path
+                break
+
+        if unresolved:
+            # Same precedence as find_path: earlier candidates win, then earlier providers, plain before "_b"
+            lookups = []
+            for i in unresolved:
+                lookups.append(candidates[i])
+                lookups.append(candidates[i].with_suffix(candidates[i].suffix + '_b'))
+            for content_provider in providers:
+                lookup_id, path = self.path_index.find_first(content_provider.root, lookups)
+                if path is not None and unresolved[lookup_id // 2] < first:
+                    first, found = unresolved[lookup_id // 2], path
+                    lookups = lookups[:lookup_id - lookup_id % 2]
+            for i in unresolved:
+                if i < first:
+                    self.resolver_cache.put(candidates[i], None)
+                elif i == first:
+                    self.resolver_cache.put(candidates[i], found)
+
+        if found is None:
+            return None, None
+        return first, found
+
     def flush_cache(self):
+        logger.debug(f'Flushing {self.resolver_cache}')
+        self.resolver_cache.clear()
         for cp in self.content_providers.values():
             cp.flush_cache()
 
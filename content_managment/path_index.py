@@ -0,0 +1,127 @@
+import json
+import logging
+import os
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, Optional, Tuple, Union, Iterable
+
+logger = logging.getLogger('PathIndex')
+
+INDEX_VERSION = 1
+
+# relative directory -> (directory mtime in ns, file names, sub-directory names)
+DirectoryTable = Dict[str, Tuple[int, List[str], List[str]]]
+
+
+def normalize_path(filepath: Union[str, Path]) -> str:
+    return str(filepath).replace('\\', '/').strip('/').lower()
+
+
+class PathIndex:
+    def __init__(self, cache_file: Optional[Path] = None):
+        self.cache_file = cache_file
+        self._directories: Dict[str, DirectoryTable] = {}
+        self._files: Dict[str, Dict[str, Path]] = {}
+        self._stems: Dict[str, Dict[str, List[Path]]] = {}
+        self._dirty = False
+        if cache_file is not None:
+            self.load()
+
+    def load(self):
+        if self.cache_file is None or not self.cache_file.exists():
+            return
+        try:
+            with self.cache_file.open('r', encoding='utf8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as ex:
+            logger.warning(f'Failed to read path index "{self.cache_file}": {ex}')
+            return
+        if data.get('version') != INDEX_VERSION:
+            return
+        for root, directories in data.get('roots', {}).items():
+            self._directories[root] = {rel_dir: (mtime, files, dirs)
+                                       for rel_dir, (mtime, files, dirs) in directories.items()}
+
+    def save(self):
+        if self.cache_file is None or not self._dirty:
+            return
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        data = {'version': INDEX_VERSION, 'roots': self._directories}
+        tmp_file = self.cache_file.with_suffix(self.cache_file.suffix + '.tmp')
+        with tmp_file.open('w', encoding='utf8') as f:
+            json.dump(data, f)
+        os.replace(tmp_file, self.cache_file)
+        self._dirty = False
+
+    def has_root(self, root: Path):
+        return str(root) in self._files
+
+    def update(self, root: Path, exclude: Iterable[str] = ()):
+        root_key = str(root)
+        exclude = {name.lower() for name in exclude}
+        old_directories = self._directories.get(root_key, {})
+        directories: DirectoryTable = {}
+        files: Dict[str, Path] = {}
+        stems: Dict[str, List[Path]] = {}
+
+        stack = ['']
+        while stack:
+            rel_dir = stack.pop()
+            abs_dir = os.path.join(root_key, rel_dir) if rel_dir else root_key
+            try:
+                mtime = os.stat(abs_dir).st_mtime_ns
+            except OSError:
+                continue
+            cached = old_directories.get(rel_dir, None)
+            if cached is not None and cached[0] == mtime:
+                file_names, dir_names = cached[1], cached[2]
+            else:
+                file_names, dir_names = [], []
+                try:
+                    with os.scandir(abs_dir) as entries:
+                        for entry in entries:
+                            if entry.is_dir():
+                                dir_names.append(entry.name)
+                            else:
+                                file_names.append(entry.name)
+                except OSError:
+                    continue
+                self._dirty = True
+            directories[rel_dir] = (mtime, file_names, dir_names)
+
+            for file_name in file_names:
+                rel_path = f'{rel_dir}/{file_name}' if rel_dir else file_name
+                key = rel_path.lower()
+                abs_path = root / rel_path
+                files[key] = abs_path
+                stems.setdefault(str(PurePosixPath(key).with_suffix('')), []).append(abs_path)
+            for dir_name in dir_names:
+                if not rel_dir and dir_name.lower() in exclude:
+                    continue
+                stack.append(f'{rel_dir}/{dir_name}' if rel_dir else dir_name)
+
+        if directories.keys() != old_directories.keys():
+            self._dirty = True
+        self._directories[root_key] = directories
+        self._files[root_key] = files
+        self._stems[root_key] = stems
+        logger.info(f'Indexed {len(files)} files in {len(directories)} directories under "{root}"')
+
+    def find(self, root: Path, filepath: Union[str, Path]) -> Optional[Path]:
+        return self._files.get(str(root), {}).get(normalize_path(filepath), None)
+
+    def find_first(self, root: Path, filepaths: Iterable[Union[str, Path]]) -> Tuple[Optional[int], Optional[Path]]:
+        """Returns (index, path) of the first of filepaths indexed under root, or (None, None)."""
+        files = self._files.get(str(root), {})
+        for i, filepath in enumerate(filepaths):
+            path = files.get(normalize_path(filepath), None)
+            if path is not None:
+                return i, path
+        return None, None
+
+    def find_stem(self, root: Path, filepath: Union[str, Path]) -> List[Path]:
+        return self._stems.get(str(root), {}).get(normalize_path(filepath), [])
+
+    def glob(self, root: Path, pattern: str):
+        for path in self._files.get(str(root), {}).values():
+            if path.relative_to(root).match(pattern):
+                yield path
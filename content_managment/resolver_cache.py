@@ -0,0 +1,68 @@
+import time
+from collections import OrderedDict
+from typing import Hashable, Any
+
+
+class ResolverCache:
+    MISS = object()
+
+    def __init__(self, capacity=4096, negative_ttl=10.0):
+        self.capacity = capacity
+        self.negative_ttl = negative_ttl
+        self._positive: OrderedDict[Hashable, Any] = OrderedDict()
+        self._negative: OrderedDict[Hashable, float] = OrderedDict()
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable):
+        value = self._positive.get(key, self.MISS)
+        if value is not self.MISS:
+            self._positive.move_to_end(key)
+            self.hits += 1
+            return value
+        expires = self._negative.get(key, None)
+        if expires is not None:
+            if expires > time.monotonic():
+                self.negative_hits += 1
+                return None
+            del self._negative[key]
+        self.misses += 1
+        return self.MISS
+
+    def put(self, key: Hashable, value: Any):
+        if value is None:
+            self._positive.pop(key, None)
+            self._negative[key] = time.monotonic() + self.negative_ttl
+            self._negative.move_to_end(key)
+            self._trim(self._negative)
+        else:
+            self._negative.pop(key, None)
+            self._positive[key] = value
+            self._positive.move_to_end(key)
+            self._trim(self._positive)
+
+    def resize(self, capacity: int):
+        self.capacity = capacity
+        self._trim(self._positive)
+        self._trim(self._negative)
+
+    def _trim(self, entries: OrderedDict):
+        while len(entries) > self.capacity:
+            entries.popitem(last=False)
+
+    def clear_negative(self):
+        self._negative.clear()
+
+    def clear(self):
+        self._positive.clear()
+        self._negative.clear()
+        self.hits = self.negative_hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._positive) + len(self._negative)
+
+    def __str__(self):
+        return (f'<ResolverCache {len(self._positive)}+{len(self._negative)}/{self.capacity} '
+                f'hits:{self.hits} negative hits:{self.negative_hits} misses:{self.misses}>')
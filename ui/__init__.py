@@ -1,6 +1,9 @@
+from glob import escape
+
 import bpy
 
-from .operators import PRAGMA_OT_PMLDImport, PRAGMA_OT_PMATImport, PRAGMA_OT_PMAPImport
+from ..asset_handlers.pmdl import sparse_flex_names
+from .operators import PRAGMA_OT_PMLDImport, PRAGMA_OT_PMATImport, PRAGMA_OT_PMAPImport, PRAGMA_OT_MaterializeFlexes
 from .prefs import PragmaPluginPreferences
 
 
@@ -13,3 +16,34 @@ class PRAGMA_MT_Menu(bpy.types.Menu):
         layout.operator(PRAGMA_OT_PMAPImport.bl_idname, text="Pramga map (.pmap, .pmap_b)", )
         layout.operator(PRAGMA_OT_PMLDImport.bl_idname, text="Pramga model (.pmdl, .pmdl_b)", )
         layout.operator(PRAGMA_OT_PMATImport.bl_idname, text="Pramga material (.pmat, .pmat_b)", )
+
+
+class PRAGMA_PT_Flexes(bpy.types.Panel):
+    bl_label = "Pragma Flexes"
+    bl_idname = "DATA_PT_pragma_flexes"
+    bl_space_type = 'PROPERTIES'
+    bl_region_type = 'WINDOW'
+    bl_context = "data"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.object
+        return obj is not None and obj.type == 'MESH' and 'pragma_flexes' in obj.data
+
+    def draw(self, context):
+        layout = self.layout
+        names = sparse_flex_names(context.object.data)
+        layout.operator(PRAGMA_OT_MaterializeFlexes.bl_idname, text=f"Materialize all ({len(names)})").flex_filter = '*'
+        column = layout.column(align=True)
+        for name in names:
+            row = column.row(align=True)
+            row.label(text=name)
+            operator = row.operator(PRAGMA_OT_MaterializeFlexes.bl_idname, text="", icon='SHAPEKEY_DATA')
+            operator.flex_filter = escape(name)
+
+
+def menu_shape_key_specials(self, context):
+    layout = self.layout
+    layout.separator()
+    layout.operator(PRAGMA_OT_MaterializeFlexes.bl_idname)
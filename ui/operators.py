@@ -1,14 +1,22 @@
 from pathlib import Path
 
 import bpy
-from bpy.props import StringProperty, CollectionProperty, BoolProperty, FloatProperty
+from bpy.props import StringProperty, CollectionProperty, BoolProperty, FloatProperty, EnumProperty
 
-from ..pragma_udm_wrapper import UDM
 from ..content_managment.content_manager import ContentManager
-from ..asset_handlers.pmat import import_pmat
-from ..asset_handlers.pmdl import import_pmdl
+from ..asset_handlers.pmat import import_pmat_file
+from ..asset_handlers.pmdl import import_pmdl, materialize_flexes
 from ..asset_handlers.pmap import import_pmap
-from .prefs import get_game_root
+from ..asset_handlers.texture_registry import ImageRegistry
+from .prefs import get_game_root, get_preferences, get_path_index_file
+
+
+def setup_importers():
+    preferences = get_preferences()
+    content_manager = ContentManager()
+    content_manager.resolver_cache.resize(preferences.path_cache_size)
+    content_manager.set_root(get_game_root(), get_path_index_file(), use_path_index=preferences.use_path_index)
+    ImageRegistry().max_workers = preferences.texture_decode_workers
 
 
 class PRAGMA_OT_PMLDImport(bpy.types.Operator):
@@ -22,6 +30,17 @@ class PRAGMA_OT_PMLDImport(bpy.types.Operator):
     filter_glob: StringProperty(default="*.pmdl;*.pmdl_b", options={'HIDDEN'})
 
     single_collection: BoolProperty(name="Load everything into 1 collection", default=False, subtype='UNSIGNED')
+    sparse_flexes: BoolProperty(name="Store flexes compactly", default=False,
+                                description="Keep flexes as sparse per-vertex deltas on the mesh instead of "
+                                            "creating shape keys. Use \"Materialize Pragma flexes\" to create "
+                                            "shape keys for the ones you need")
+    share_armature: BoolProperty(name="Share identical armatures", default=False,
+                                 description="Reuse the armature data of a previously imported model "
+                                             "with the same skeleton")
+    merge_mode: EnumProperty(name="Merge sub-meshes", default='NONE',
+                             items=(('NONE', "Don't merge", "One object per sub-mesh"),
+                                    ('MESH', "Per mesh", "One object per mesh, sub-meshes become material slots"),
+                                    ('MESH_GROUP', "Per mesh group", "One object per mesh group")))
 
     def execute(self, context):
 
@@ -29,9 +48,11 @@ class PRAGMA_OT_PMLDImport(bpy.types.Operator):
             directory = Path(self.filepath).parent.absolute()
         else:
             directory = Path(self.filepath).absolute()
-        ContentManager().set_root(get_game_root())
+        setup_importers()
         for n, file in enumerate(self.files):
-            import_pmdl(directory / file.name, no_collections=self.single_collection)
+            import_pmdl(directory / file.name, no_collections=self.single_collection,
+                        sparse_flexes=self.sparse_flexes, share_armature=self.share_armature,
+                        merge_mode=self.merge_mode)
         return {'FINISHED'}
 
     def invoke(self, context, event):
@@ -51,6 +72,12 @@ class PRAGMA_OT_PMAPImport(bpy.types.Operator):
     filter_glob: StringProperty(default="*.pmap;*.pmap_b", options={'HIDDEN'})
 
     single_collection: BoolProperty(name="Load everything into 1 collection", default=False, subtype='UNSIGNED')
+    use_instances: BoolProperty(name="Instance repeated models", default=True,
+                                description="Import each unique model once and place collection instances")
+    sparse_flexes: BoolProperty(name="Store flexes compactly", default=False,
+                                description="Keep flexes as sparse per-vertex deltas on the mesh instead of "
+                                            "creating shape keys. Use \"Materialize Pragma flexes\" to create "
+                                            "shape keys for the ones you need")
 
     def execute(self, context):
 
@@ -58,9 +85,9 @@ class PRAGMA_OT_PMAPImport(bpy.types.Operator):
             directory = Path(self.filepath).parent.absolute()
         else:
             directory = Path(self.filepath).absolute()
-        ContentManager().set_root(get_game_root())
+        setup_importers()
         for n, file in enumerate(self.files):
-            import_pmap(directory / file.name)
+            import_pmap(directory / file.name, use_instances=self.use_instances, sparse_flexes=self.sparse_flexes)
         return {'FINISHED'}
 
     def invoke(self, context, event):
@@ -85,15 +112,38 @@ class PRAGMA_OT_PMATImport(bpy.types.Operator):
             directory = Path(self.filepath).parent.absolute()
         else:
             directory = Path(self.filepath).absolute()
-        ContentManager().set_root(get_game_root())
+        setup_importers()
+        reused = 0
         for n, file in enumerate(self.files):
-            udm = UDM()
-            udm.load(directory / file.name)
-            print(udm, udm.root)
-            import_pmat(udm.root, file.name)
+            if import_pmat_file(directory / file.name, file.name) == 'REUSED':
+                reused += 1
+        ImageRegistry().load_pending()
+        if reused:
+            self.report({'INFO'}, f'Reused {reused} already imported materials')
         return {'FINISHED'}
 
     def invoke(self, context, event):
         wm = context.window_manager
         wm.fileselect_add(self)
         return {'RUNNING_MODAL'}
+
+
+class PRAGMA_OT_MaterializeFlexes(bpy.types.Operator):
+    """Create shape keys from flexes stored compactly on the active mesh"""
+    bl_idname = "pragma.materialize_flexes"
+    bl_label = "Materialize Pragma flexes"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    flex_filter: StringProperty(name="Flexes", default="*",
+                                description="Comma separated name patterns of the flexes to create")
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.active_object
+        return obj is not None and obj.type == 'MESH' and 'pragma_flexes' in obj.data
+
+    def execute(self, context):
+        patterns = [pattern.strip() for pattern in self.flex_filter.split(',') if pattern.strip()]
+        names = materialize_flexes(context.active_object, patterns)
+        self.report({'INFO'}, f'Created {len(names)} shape keys')
+        return {'FINISHED'}
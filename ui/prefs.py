@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 import bpy
@@ -11,12 +12,33 @@ def set_game_root(path):
     bpy.context.preferences.addons['pragma_udm_io'].preferences.path = str(path)
 
 
+def get_preferences():
+    return bpy.context.preferences.addons['pragma_udm_io'].preferences
+
+
+def get_path_index_file():
+    return Path(bpy.utils.user_resource('CONFIG')) / 'pragma_udm_io_path_index.json'
+
+
 class PragmaPluginPreferences(bpy.types.AddonPreferences):
     bl_idname = 'pragma_udm_io'
 
     path: bpy.props.StringProperty(name="Game root", subtype='FILE_PATH', description='')
+    use_path_index: bpy.props.BoolProperty(name="Use file index", default=False,
+                                           description='Keep a persistent index of game files instead of '
+                                                       'probing the disk for every lookup')
+    path_cache_size: bpy.props.IntProperty(name="Path cache size", default=4096, min=128,
+                                           description='Maximum number of resolved asset paths kept in memory')
+    texture_decode_workers: bpy.props.IntProperty(name="Texture decode threads", default=os.cpu_count() or 1,
+                                                  min=1, max=256,
+                                                  description='Number of threads used to decode textures')
 
     def draw(self, context):
         layout = self.layout
         row = layout.row()
         row.prop(self, "path")
+        row = layout.row()
+        row.prop(self, "use_path_index")
+        row.prop(self, "path_cache_size")
+        row = layout.row()
+        row.prop(self, "texture_decode_workers")
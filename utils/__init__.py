@@ -16,22 +16,38 @@ ROT90_Z = Euler([0, 0, math.radians(90)]).to_matrix().to_4x4()
 ROTN90_Z = Euler([0, 0, math.radians(-90)]).to_matrix().to_4x4()
 
 
-def get_material(mat_name, model_ob):
-    md = model_ob.data
+def _get_or_create_material(mat_name):
     mat = bpy.data.materials.get(mat_name, None)
-    if mat:
-        if md.materials.get(mat.name, None):
-            for i, material in enumerate(md.materials):
-                if material == mat:
-                    return i
-        else:
-            md.materials.append(mat)
-            return len(md.materials) - 1
-    else:
+    if mat is None:
         mat = bpy.data.materials.new(mat_name)
         mat.diffuse_color = [random.uniform(.4, 1) for _ in range(3)] + [1.0]
-        md.materials.append(mat)
-        return len(md.materials) - 1
+    return mat
+
+
+class MaterialSlotIndex:
+    """Material name -> slot lookup for one mesh, for meshes that get many materials assigned."""
+
+    def __init__(self, mesh_data: bpy.types.Mesh):
+        self.mesh_data = mesh_data
+        self._slots = {mat.name: slot for slot, mat in enumerate(mesh_data.materials) if mat is not None}
+
+    def get_slot(self, mat_name):
+        slot = self._slots.get(mat_name, None)
+        if slot is None:
+            mat = _get_or_create_material(mat_name)
+            slot = self._slots.get(mat.name, None)
+            if slot is None:
+                self.mesh_data.materials.append(mat)
+                slot = self._slots[mat.name] = len(self.mesh_data.materials) - 1
+            self._slots[mat_name] = slot
+        return slot
+
+    def assign(self, mat_names, face_counts):
+        """Gives each consecutive run of face_counts[i] polygons material mat_names[i]."""
+        slots = np.array([self.get_slot(mat_name) for mat_name in mat_names], dtype=np.int32)
+        material_indices = np.repeat(slots, face_counts)
+        self.mesh_data.polygons.foreach_set('material_index', material_indices)
+        return slots
 
 
 def get_or_create_collection(name, parent: bpy.types.Collection) -> bpy.types.Collection:
@@ -51,6 +67,23 @@ def get_new_unique_collection(model_name, parent_collection):
     return master_collection
 
 
+def _find_layer_collection(layer_collection: bpy.types.LayerCollection, collection: bpy.types.Collection):
+    if layer_collection.collection == collection:
+        return layer_collection
+    for child in layer_collection.children:
+        found = _find_layer_collection(child, collection)
+        if found is not None:
+            return found
+    return None
+
+
+def exclude_collection(collection: bpy.types.Collection, view_layer=None):
+    view_layer = view_layer or bpy.context.view_layer
+    layer_collection = _find_layer_collection(view_layer.layer_collection, collection)
+    if layer_collection is not None:
+        layer_collection.exclude = True
+
+
 def append_blend(filepath, type_name, link=False):
     with bpy.data.libraries.load(filepath, link=link) as (data_from, data_to):
         setattr(data_to, type_name, [asset for asset in getattr(data_from, type_name)])
@@ -65,6 +98,16 @@ def transform_vec3_array(vec3, matrix):
     return tmp[:, :3]
 
 
+def pragma_to_blender_vec3_array(vec3, out=None):
+    # Same result as transform_vec3_array(vec3, ROTN90_X), done as a swizzle instead of a 4x4 product
+    if out is None:
+        out = np.empty((len(vec3), 3), dtype=np.float32)
+    out[:, 0] = vec3[:, 0]
+    np.negative(vec3[:, 2], out=out[:, 1])
+    out[:, 2] = vec3[:, 1]
+    return out
+
+
 def transform_vec3(vec3, matrix):
     tmp = np.zeros((4,), dtype=np.float32)
     tmp[:3] = vec3
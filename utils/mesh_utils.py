@@ -0,0 +1,70 @@
+from typing import Iterator, Tuple
+
+import numpy as np
+
+# Vertex weights are rounded to this step before bucketing, 8 bit precision is below what anyone can see
+DEFAULT_WEIGHT_STEP = 1 / 255
+
+
+def build_mesh(mesh_data, positions: np.ndarray, indices: np.ndarray, normals: np.ndarray = None,
+               uvs: np.ndarray = None):
+    vertex_count = len(positions)
+    loop_count = len(indices)
+    face_count = loop_count // 3
+
+    mesh_data.vertices.add(vertex_count)
+    mesh_data.vertices.foreach_set('co', np.ascontiguousarray(positions, dtype=np.float32).reshape(-1))
+
+    mesh_data.loops.add(loop_count)
+    mesh_data.loops.foreach_set('vertex_index', np.ascontiguousarray(indices, dtype=np.int32).reshape(-1))
+
+    mesh_data.polygons.add(face_count)
+    mesh_data.polygons.foreach_set('loop_start', np.arange(0, loop_count, 3, dtype=np.int32))
+    mesh_data.polygons.foreach_set('loop_total', np.full(face_count, 3, dtype=np.int32))
+    mesh_data.polygons.foreach_set('use_smooth', np.ones(face_count, dtype=bool))
+
+    mesh_data.update(calc_edges=True)
+
+    if normals is not None:
+        mesh_data.normals_split_custom_set_from_vertices(normals)
+        mesh_data.use_auto_smooth = True
+
+    if uvs is not None:
+        uv_layer = mesh_data.uv_layers.new()
+        # Loops map 1:1 onto the index buffer, so per-loop UVs are a single gather
+        uv_layer.data.foreach_set('uv', np.ascontiguousarray(uvs[indices], dtype=np.float32).reshape(-1))
+
+    return mesh_data
+
+
+def bucket_vertex_weights(bone_ids: np.ndarray, bone_weights: np.ndarray, vertex_offset=0,
+                          weight_step=DEFAULT_WEIGHT_STEP) -> Iterator[Tuple[int, float, np.ndarray]]:
+    """Groups (V, N) bone ids and weights into (bone id, weight, vertex ids) buckets.
+    Weights are rounded to weight_step first so near equal weights share a bucket, 0 keeps them exact.
+    """
+    vertex_count = len(bone_ids)
+    bone_ids = np.asarray(bone_ids).reshape(-1)
+    bone_weights = np.asarray(bone_weights, dtype=np.float32).reshape(-1)
+    influence_count = bone_ids.size // max(vertex_count, 1)
+    vertex_ids = np.repeat(np.arange(vertex_count, dtype=np.int32) + vertex_offset, influence_count)
+
+    valid = (bone_ids >= 0) & (bone_weights >= 0)
+    bone_ids = bone_ids[valid]
+    bone_weights = bone_weights[valid]
+    vertex_ids = vertex_ids[valid]
+    if bone_ids.size == 0:
+        return
+    if weight_step > 0:
+        bone_weights = (np.round(bone_weights / weight_step) * weight_step).astype(np.float32)
+
+    # Sort by (bone, weight) so every bucket of equal weights on one bone becomes a single VertexGroup.add call
+    order = np.lexsort((bone_weights, bone_ids))
+    bone_ids = bone_ids[order]
+    bone_weights = bone_weights[order]
+    vertex_ids = vertex_ids[order]
+
+    bucket_starts = np.flatnonzero((np.diff(bone_ids) != 0) | (np.diff(bone_weights) != 0)) + 1
+    bucket_starts = np.concatenate(([0], bucket_starts))
+    bucket_ends = np.concatenate((bucket_starts[1:], [bone_ids.size]))
+    for start, end in zip(bucket_starts.tolist(), bucket_ends.tolist()):
+        yield int(bone_ids[start]), float(bone_weights[start]), vertex_ids[start:end]
@@ -122,7 +122,7 @@ def create_node(material, node_type: str, name: str = None, location=None):
 
 
 def create_node_group(material, group_name, location=None, *, name=None):
-    group_node = material.create_node(Nodes.ShaderNodeGroup, name or group_name)
+    group_node = create_node(material, Nodes.ShaderNodeGroup, name or group_name)
     group_node.node_tree = bpy.data.node_groups.get(group_name)
     group_node.width = group_node.bl_width_max
     if location is not None:
@@ -1,22 +1,65 @@
+import struct
+
 import bpy
 import numpy as np
 
+TGA_HEADER = struct.Struct('<3B2HB4H2B')
+
+# Reused between uploads that have to go through Image.pixels, grown on demand
+_float_scratch = np.empty(0, dtype=np.float32)
+
+
+def encode_tga(rgba_data: np.ndarray, width: int, height: int) -> bytes:
+    # Rows are expected bottom to top, which is the default TGA origin
+    buffer = bytearray(TGA_HEADER.size + width * height * 4)
+    TGA_HEADER.pack_into(buffer, 0, 0, 0, 2, 0, 0, 0, 0, 0, width, height, 32, 8)
+    pixels = np.frombuffer(buffer, dtype=np.uint8, offset=TGA_HEADER.size).reshape((height, width, 4))
+    pixels[:, :, 0] = rgba_data[:, :, 2]
+    pixels[:, :, 1] = rgba_data[:, :, 1]
+    pixels[:, :, 2] = rgba_data[:, :, 0]
+    pixels[:, :, 3] = rgba_data[:, :, 3]
+    return bytes(buffer)
+
+
+def _upload_packed(image, rgba_data, width, height):
+    data = encode_tga(rgba_data, width, height)
+    try:
+        image.pack(data=data, data_len=len(data))
+    except (TypeError, RuntimeError):
+        return False
+    image.source = 'FILE'
+    image.reload()
+    return True
+
+
+def _upload_float(image, rgba_data, width, height):
+    global _float_scratch
+    pixel_count = width * height * 4
+    if _float_scratch.size < pixel_count:
+        _float_scratch = np.empty(pixel_count, dtype=np.float32)
+    pixels = _float_scratch[:pixel_count]
+    # rgba_data is usually a flipped view, so the flip happens during this single conversion pass
+    np.multiply(rgba_data, np.float32(1 / 255), out=pixels.reshape((height, width, 4)), dtype=np.float32)
+    if tuple(image.size) != (width, height):
+        image.scale(width, height)
+    image.pixels.foreach_set(pixels)
+    image.pack()
+
 
 def texture_from_data(name, rgba_data, image_dimm, update):
     if bpy.data.images.get(name, None) and not update:
         return bpy.data.images.get(name)
-    pixels = np.divide(rgba_data, 255, dtype=np.float32).flatten()
+    width, height = image_dimm
     image = bpy.data.images.get(name, None) or bpy.data.images.new(
         name,
-        width=image_dimm[0],
-        height=image_dimm[1],
+        width=width,
+        height=height,
         alpha=True,
     )
     image.filepath = name + '.tga'
     image.alpha_mode = 'CHANNEL_PACKED'
     image.file_format = 'TARGA'
 
-    image.pixels.foreach_set(pixels)
-
-    image.pack()
+    if not _upload_packed(image, rgba_data, width, height):
+        _upload_float(image, rgba_data, width, height)
     return image